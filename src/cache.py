@@ -0,0 +1,131 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Content-hashed cache for the merged corpus.
+
+Every artifact (the base alignments, the tags, the ngram scores, each
+nn model's scores and the final corpus) is saved as its own store under
+project_dir/cache, in a directory named after the hash of its inputs.
+File hashes are remembered by size and modification time so unchanged
+inputs are not read again.
+
+Each artifact also has a slot, its name and the settings (input paths,
+models) it is built for.  Once a build supersedes what a slot held, e.g.
+after an input file changed, the old artifact is removed, while those
+built for other settings, e.g. another nnmodel, stay (see Cache.keep).
+"""
+
+
+import hashlib
+import json
+import os
+import shutil
+import profiler
+import store
+
+
+CACHE_VERSION = 3
+HASHES_FILE = 'hashes.json'
+FINGERPRINTS_FILE = 'conversations.json'
+SLOTS_FILE = 'slots.json'
+
+
+class Cache:
+
+	def __init__(self, project_dir):
+		self.root = os.path.join(project_dir, 'cache')
+		self.memo_file = os.path.join(self.root, HASHES_FILE)
+		self.memo = dict()
+		if os.path.exists(self.memo_file):
+			with open(self.memo_file, 'r') as f:
+				self.memo = json.load(f)
+
+	def file_hash(self, path):
+		"""sha1 of the file contents, reusing the last hash if the file is unchanged."""
+		stat = os.stat(path)
+		path = os.path.abspath(path)
+		seen = self.memo.get(path)
+		if seen and seen['size'] == stat.st_size and seen['mtime'] == stat.st_mtime_ns:
+			return seen['sha1']
+
+		h = hashlib.sha1()
+		with open(path, 'rb') as f:
+			for chunk in iter(lambda: f.read(1 << 20), b''):
+				h.update(chunk)
+		self.memo[path] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha1': h.hexdigest()}
+		return h.hexdigest()
+
+	def key(self, *parts):
+		"""Cache key of an artifact given its files, settings and upstream keys."""
+		values = [CACHE_VERSION]
+		for part in parts:
+			if isinstance(part, (list, tuple)):
+				values.append([self.file_hash(x) for x in part])
+			else:
+				values.append(part)
+		return hashlib.sha1(json.dumps(values).encode('utf-8')).hexdigest()
+
+	def path(self, name, key):
+		return os.path.join(self.root, '{}-{}'.format(name, key[:16]))
+
+	def has(self, name, key):
+		return store.exists(self.path(name, key))
+
+	def save(self, name, key, df):
+		with profiler.stage('save ' + name):
+			profiler.count('rows', len(df))
+			store.write_store(df, self.path(name, key))
+			self.save_memo()
+
+	def load(self, name, key):
+		with profiler.stage('open ' + name):
+			return store.open_store(self.path(name, key))
+
+	def remove(self, name, key):
+		shutil.rmtree(self.path(name, key), ignore_errors=True)
+
+	def read_json(self, name):
+		path = os.path.join(self.root, name)
+		if not os.path.exists(path):
+			return dict()
+		with open(path, 'r') as f:
+			return json.load(f)
+
+	def write_json(self, name, value):
+		os.makedirs(self.root, exist_ok=True)
+		with open(os.path.join(self.root, name), 'w') as f:
+			json.dump(value, f, indent=1)
+
+	def save_fingerprints(self, slot, key, fingerprints, files):
+		"""Remembers the per-conversation fingerprints of the corpus saved under
+		key for slot, and the conversation index of each of its input files."""
+		stored = self.read_json(FINGERPRINTS_FILE)
+		stored[slot] = {'corpus': key, 'conversations': fingerprints, 'files': files}
+		self.write_json(FINGERPRINTS_FILE, stored)
+
+	def last_fingerprints(self, slot):
+		"""Key, per-conversation fingerprints and input file indexes of the last
+		corpus saved for slot."""
+		last = self.read_json(FINGERPRINTS_FILE).get(slot)
+		if last is None:
+			return None, None, dict()
+		return last['corpus'], last['conversations'], last.get('files', dict())
+
+	def keep(self, slots):
+		"""Records the [name, key] each slot now holds and removes every entry
+		no slot holds, e.g. what a slot held before.  A slot is an artifact and
+		the settings it is built for, so each setting keeps only its latest
+		build and builds for other settings stay."""
+		held = self.read_json(SLOTS_FILE)
+		held.update(slots)
+		paths = {self.path(name, key) for name, key in held.values()}
+		for entry in os.listdir(self.root):
+			path = os.path.join(self.root, entry)
+			if os.path.isdir(path) and path not in paths:
+				shutil.rmtree(path, ignore_errors=True)
+		self.write_json(SLOTS_FILE, held)
+
+	def save_memo(self):
+		os.makedirs(self.root, exist_ok=True)
+		with open(self.memo_file, 'w') as f:
+			json.dump(self.memo, f, indent=1)
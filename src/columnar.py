@@ -0,0 +1,323 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Columnar error extraction.
+
+Every list-valued column is flattened into one contiguous value buffer plus
+per-utterance offsets.  The ptb/ms/dtok/disf pointers and the error sequence
+boundaries are then found with cumulative sums over boolean masks instead of
+walking each alignment token by token.  Only the tokens that end up inside an
+error sequence are visited in Python, to build the same ErrSeq objects as
+main.ErrorExtractor.
+"""
+
+
+import itertools
+import numpy as np
+import pandas as pd
+import surprisal
+import util
+import vocab
+from errinfo import ErrSeq, Lex
+from vocab import Vocab
+from util import get_col
+
+
+DTYPES = ('ptb', 'ms')
+DATATYPES = ('token', 'name', 'shape', 'score', 'nn_score', 'disf')
+# pointers of main.ErrorExtractor, stored with the corpus as 'ix_<pointer>' columns
+POINTERS = ('ptb', 'ms', 'ptb_dtok', 'ptb_disf', 'ms_dtok', 'ms_disf')
+
+
+class Ragged:
+	"""A list-valued column stored as a flat value buffer plus row offsets.
+	With a vocab the values are the codes of strings in it."""
+
+	def __init__(self, values, offsets, vocab=None):
+		self.values = values
+		self.offsets = offsets
+		self.vocab = vocab
+
+	@classmethod
+	def from_lists(cls, lists):
+		lengths = np.fromiter((len(x) for x in lists), dtype=np.int64, count=len(lists))
+		offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+		np.cumsum(lengths, out=offsets[1:])
+		values = np.array(list(itertools.chain.from_iterable(lists)))
+		return cls(values, offsets)
+
+	def __len__(self):
+		return len(self.offsets) - 1
+
+	def lengths(self):
+		return np.diff(self.offsets)
+
+	def encode(self):
+		"""The same column with its strings interned, self if already coded."""
+		if self.vocab is not None:
+			return self
+		vocab, codes = Vocab.build(self.values)
+		return Ragged(codes, self.offsets, vocab)
+
+	def decoded(self):
+		return self.values if self.vocab is None else self.vocab.decode(self.values)
+
+	def row(self, i):
+		values = self.values[self.offsets[i]:self.offsets[i + 1]]
+		return values if self.vocab is None else self.vocab.decode(values)
+
+	def take(self, rows):
+		"""A new Ragged holding only the given rows, in the given order."""
+		lengths = self.lengths()[rows]
+		offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+		np.cumsum(lengths, out=offsets[1:])
+		flat = np.repeat(self.offsets[rows] - offsets[:-1], lengths) + np.arange(offsets[-1])
+		return Ragged(self.values[flat], offsets, self.vocab)
+
+	def to_lists(self):
+		values = self.decoded().tolist()
+		return [values[s:e] for s, e in zip(self.offsets[:-1].tolist(), self.offsets[1:].tolist())]
+
+	def gather_codes(self, rows, pos):
+		"""Code at pos of each row of a coded column, vocab.MISSING where there is none."""
+		valid = (pos >= 0) & (pos < self.lengths()[rows])
+		if not len(self.values):
+			return np.full(len(rows), vocab.MISSING), valid
+		flat = np.where(valid, self.offsets[rows] + pos, 0)
+		return np.where(valid, self.values[flat].astype(np.int64), vocab.MISSING), valid
+
+	def gather(self, rows, pos, fill):
+		"""Returns the value at pos of each row and a mask of the positions that exist."""
+		if self.vocab is not None:
+			codes, valid = self.gather_codes(rows, pos)
+			return self.vocab.decode(codes, fill), valid
+		valid = (pos >= 0) & (pos < self.lengths()[rows])
+		if not len(self.values):
+			return np.full(len(rows), fill), valid
+		flat = np.where(valid, self.offsets[rows] + pos, 0)
+		return np.where(valid, self.values[flat], fill), valid
+
+
+def flatten(alignment, models=()):
+	"""Flattens the columns the extraction reads into Ragged columns."""
+	if not isinstance(alignment, pd.DataFrame):
+		return alignment  # already columnar, e.g. a store.Corpus
+	cols = {'comb_ann': Ragged.from_lists(alignment['comb_ann'].tolist())}
+	for dtype in DTYPES:
+		for col in [get_col(x, dtype) for x in DATATYPES] + util.get_score_cols(dtype, models):
+			cols[col] = Ragged.from_lists(alignment[col].tolist())
+	if 'ix_ptb' in alignment:
+		for k in POINTERS:
+			cols['ix_' + k] = Ragged.from_lists(alignment['ix_' + k].tolist())
+	return cols
+
+
+def _count_before(mask, token_start):
+	"""Number of True values of mask before each token, within its utterance."""
+	total = np.zeros(len(mask) + 1, dtype=np.int64)
+	np.cumsum(mask, out=total[1:])
+	return total[:-1] - total[token_start], total
+
+
+def _ends_with(names, codes, suffix):
+	return names.vocab.table(lambda x: x.endswith(suffix))[codes]
+
+
+def _tokens(ann):
+	"""Utterance, first token of its utterance and label code of every token."""
+	lengths = ann.lengths()
+	utt = np.repeat(np.arange(len(ann)), lengths)
+	token_start = np.repeat(ann.offsets[:-1], lengths)
+	return utt, token_start, ann.vocab.recode(vocab.LABELS)[ann.values]
+
+
+def _name_flags(cols, utt, ptb_ix, ms_ix):
+	"""Special token, '_a' split and '_b' split flags of each token, from the
+	names under its ptb and ms pointers."""
+	ptb_names = cols[get_col('name', 'ptb')].encode()
+	ms_names = cols[get_col('name', 'ms')].encode()
+	name = ptb_names.gather_codes(utt, ptb_ix)[0]
+	ms_name = ms_names.gather_codes(utt, ms_ix)[0]
+	special = ptb_names.vocab.table({'None'})[name] & ms_names.vocab.table({'None'})[ms_name]
+	split = {'ptb': _ends_with(ptb_names, name, '_a'), 'ms': _ends_with(ms_names, ms_name, '_a')}
+	ends_b = {'ptb': _ends_with(ptb_names, name, '_b'), 'ms': _ends_with(ms_names, ms_name, '_b')}
+	return special, split, ends_b
+
+
+def pointer_tables(cols):
+	"""The POINTERS of main.ErrorExtractor before each token of every
+	alignment and after its last one, where an EOS is added, as Ragged
+	columns of one more value per utterance than comb_ann.  Only comb_ann and
+	the ptb and ms names are read."""
+	ann = cols['comb_ann'].encode()
+	utt, token_start, labels = _tokens(ann)
+	on_side = {'ptb': vocab.ON_PTB[labels], 'ms': vocab.ON_MS[labels]}
+	special, split, _ = _name_flags(cols, utt, _count_before(on_side['ptb'], token_start)[0],
+									_count_before(on_side['ms'], token_start)[0])
+
+	# entry k of a row is the pointer before its token k
+	offsets = ann.offsets + np.arange(len(ann) + 1)
+	rows = np.repeat(np.arange(len(ann)), ann.lengths() + 1)
+	token = np.arange(offsets[-1]) - rows
+	tables = dict()
+	for dtype in DTYPES:
+		incs = {dtype: on_side[dtype], dtype + '_disf': on_side[dtype] & ~special}
+		incs[dtype + '_dtok'] = incs[dtype + '_disf'] & ~split[dtype]
+		for k, inc in incs.items():
+			total = _count_before(inc, token_start)[1]
+			values = (total[token] - total[ann.offsets[rows]]).astype(np.int32)
+			tables[k] = Ragged(values, offsets)
+	return tables
+
+
+def _gather_values(cols, dtype, models, utt, dtok, disf, b_split):
+	"""Token, shape, disfluency and score lookups for a set of tokens of one of ptb/ms."""
+	v = dict()
+	v['token'], tok_ok = cols[get_col('token', dtype)].gather(utt, dtok, '')
+	v['shape'], shape_ok = cols[get_col('shape', dtype)].gather(utt, dtok, '')
+	v['disf'], disf_ok = cols[get_col('disf', dtype)].gather(utt, disf, 'O')
+	v['ok'] = tok_ok & shape_ok & disf_ok
+
+	# disfluency of the previous token, stepping over the first half of a split
+	prev_ix = disf - 1 - b_split
+	v['prev'], prev_ok = cols[get_col('disf', dtype)].gather(utt, prev_ix, 'O')
+	has_prev = disf > 1
+	v['prev'] = np.where(has_prev, v['prev'], 'O')
+	v['prev_ok'] = ~has_prev | prev_ok
+
+	scores = list()
+	v['score_ok'] = np.ones(len(utt), dtype=bool)
+	for col in util.get_score_cols(dtype, models):
+		score, score_ok = cols[col].gather(utt, dtok, 0.01)
+		scores.append(score.tolist())
+		v['score_ok'] &= score_ok
+	v = {k: x.tolist() for k, x in v.items()}
+	v['scores'] = list(zip(*scores))
+	return v
+
+
+def _add_token(trans, v, k, logger, index, dtype):
+	"""Mirrors main.ErrorExtractor.process_helper on pre-gathered values."""
+	if v['ok'][k] and (trans.disf or v['prev_ok'][k]):
+		token, shape, disf = v['token'][k], v['shape'][k], v['disf'][k]
+		if not trans.disf:
+			trans.set_disf(v['prev'][k])
+	else:
+		logger.debug('INDEX ERROR {} data error at index: {}'.format(dtype, index))
+		token, shape, disf = '', '', 'O'
+	trans.set_token(token, shape)
+	_add_score(trans, v, k, disf)
+
+
+def _add_eos(trans, v, k):
+	trans.set_token('<EOS>', Lex.EOS.value)
+	_add_score(trans, v, k, 'O')
+
+
+def _add_score(trans, v, k, disf):
+	if v['score_ok'][k]:
+		trans.set_disf(disf)
+		trans.set_score(v['scores'][k])
+	else:
+		trans.set_score([0.01] * len(v['scores'][k]))
+
+
+def extract(alignment, top_n, logger, models=()):
+	"""Columnar equivalent of main.ErrorExtractor.extract on a dataframe or store.Corpus."""
+	result = list(iter_errors(alignment, top_n, logger, models))
+	surprisal.set_sup_diffs(result)
+	return result
+
+
+def iter_errors(alignment, top_n, logger, models=()):
+	return iter_columns(flatten(alignment, models), alignment.index.tolist(),
+						alignment['transcriber'].tolist(), top_n, logger, models)
+
+
+def iter_columns(cols, index, transcriber, top_n, logger, models=()):
+	"""Finds the error sequences of flattened alignments and yields them as
+	ErrSeq, summarized except for their surprisal."""
+	ann = cols['comb_ann'].encode()
+	lengths = ann.lengths()
+	n_tokens = int(ann.offsets[-1])
+	utt, token_start, labels = _tokens(ann)
+	pos = np.arange(n_tokens)
+	is_err = vocab.IS_ERR[labels]
+	on_side = {'ptb': vocab.ON_PTB[labels], 'ms': vocab.ON_MS[labels]}
+
+	# pointers stored with the corpus, or computed from the alignments
+	tables = {k: cols['ix_' + k] for k in POINTERS} if 'ix_ptb' in cols else pointer_tables(cols)
+	before = {k: np.asarray(t.values)[pos + utt] for k, t in tables.items()}
+	after = {k: np.asarray(t.values)[t.offsets[1:] - 1] for k, t in tables.items()}
+
+	# names under the pointers decide the special token and split flags
+	special, split, ends_b = _name_flags(cols, utt, before['ptb'], before['ms'])
+	any_split = split['ptb'] | split['ms'] | (ends_b['ptb'] != ends_b['ms'])
+	ptr = dict()
+	for dtype in DTYPES:
+		ptr[dtype] = (on_side[dtype] & ~split[dtype], before[dtype + '_dtok'], before[dtype + '_disf'], ends_b[dtype],
+					  after[dtype + '_dtok'])
+
+	# a sequence is open while the last error is more recent than the last closing token
+	closer = ~is_err & ~special & ~any_split
+	last_err = np.maximum.accumulate(np.where(is_err & ~special, pos, -1))
+	last_close = np.maximum.accumulate(np.where(closer, pos, -1))
+	open_after = (last_err >= token_start) & (last_err > last_close)
+	open_before = np.zeros(n_tokens, dtype=bool)
+	open_before[1:] = open_after[:-1]
+	open_before &= pos > token_start
+	included = ~special & (is_err | open_before)
+	closes = included & closer & open_before
+
+	# utterances still open at the end get an EOS token after their last included token
+	ends = ann.offsets[1:] - 1
+	eos_utt = np.flatnonzero((lengths > 0) & open_after[np.maximum(ends, 0)]) if n_tokens else ends[:0]
+	last_included = np.maximum.accumulate(np.where(included, pos, -1))
+	eos_at = np.zeros(n_tokens, dtype=bool)
+	eos_at[last_included[ends[eos_utt]]] = True
+	eos_ix = np.cumsum(eos_at) - 1
+
+	sel = np.flatnonzero(included)
+	sel_utt = utt[sel]
+	values, eos_values, calls = dict(), dict(), dict()
+	for dtype in DTYPES:
+		call, dtok, disf, b_ends, dtok_end = ptr[dtype]
+		values[dtype] = _gather_values(cols, dtype, models, sel_utt, dtok[sel], disf[sel], b_ends[sel])
+		eos_values[dtype] = _gather_values(cols, dtype, models, eos_utt, dtok_end[eos_utt],
+											np.zeros(len(eos_utt), dtype=np.int64),
+											np.zeros(len(eos_utt), dtype=bool))
+		calls[dtype] = call[sel].tolist()
+		calls[dtype + '_eos'] = (~split[dtype][ends[eos_utt]]).tolist()
+
+	sel_utt = sel_utt.tolist()
+	sel_labels = ann.vocab.decode(ann.values[sel]).tolist()
+	sel_edge = ((sel == token_start[sel]) | (sel == ends[utt[sel]])).tolist()
+	sel_closes = closes[sel].tolist()
+	sel_eos = eos_ix[sel].tolist()
+	sel_eos_at = eos_at[sel].tolist()
+
+	current = ErrSeq(models)
+	for k, u in enumerate(sel_utt):
+		if not current.index:
+			current.index = index[u]
+			current.transcriber = transcriber[u]
+		label = sel_labels[k]
+		current.add_type(label)
+		if calls['ptb'][k]:
+			_add_token(current.ptb, values['ptb'], k, logger, index[u], 'ptb')
+		if calls['ms'][k]:
+			_add_token(current.ms, values['ms'], k, logger, index[u], 'ms')
+			if label == 'DEL' and sel_edge[k]:
+				current.del_edge = True
+
+		if sel_eos_at[k]:
+			e = sel_eos[k]
+			current.add_type(util.get_norm_label())
+			if calls['ptb_eos'][e]:
+				_add_eos(current.ptb, eos_values['ptb'], e)
+			if calls['ms_eos'][e]:
+				_add_eos(current.ms, eos_values['ms'], e)
+		if sel_closes[k] or sel_eos_at[k]:
+			current.summarize(top_n, sup=False)
+			yield current
+			current = ErrSeq(models)
@@ -7,64 +7,263 @@ processing for tsv output.
 """
 
 
+import hashlib
+import io
+import json
 import os
-import csv
-import itertools
+import re
 from ast import literal_eval
-import pickle
+from collections import defaultdict
+from concurrent.futures import as_completed
+import numpy as np
 import pandas as pd
-
-
-def read_tsv(tsv_file, header=0):
-	"""Given a tsv file reads and returns as pandas dataframe."""
-	df = pd.read_csv(tsv_file, sep='\t', header=header, quotechar="\"")
-	
+import profiler
+import util
+from cache import CACHE_VERSION, Cache
+from columnar import Ragged, pointer_tables
+from loader import Loader
+from sink import BATCH_SIZE, ParquetWriter, ResultSink, SqliteWriter, TsvWriter, restore
+
+
+STR_LIST = 'str_list'
+FLOAT_LIST = 'float_list'
+INT_LIST = 'int_list'
+
+# list-encoded columns of the alignments, tags and scores files
+ALIGNMENT_SCHEMA = {
+	'sentence': STR_LIST, 'names': STR_LIST, 'disfl': STR_LIST, 'sentence_dtok': STR_LIST,
+	'ms_sentence': STR_LIST, 'ms_names': STR_LIST, 'ms_disfl': STR_LIST, 'ms_sentence_dtok': STR_LIST,
+	'comb_sentence': STR_LIST, 'comb_ann': STR_LIST
+}
+TAGS_SCHEMA = {'tags': STR_LIST, 'shapes': INT_LIST}
+SCORES_SCHEMA = {'scores': FLOAT_LIST}
+
+IX_COLS = ['file', 'speaker', 'turn', 'sent_num']
+
+# artifacts merged onto the alignments, with the names of their ptb columns.
+# nn models after the first are merged as 'nn-<model>' into 'scores-<model>'
+MODEL_COLUMNS = {
+	'tags': {'tags': 'tags', 'shapes': 'shapes'},
+	'ngram': {'scores': 'scores-ngram'},
+	'nn': {'scores': 'scores-gru'},
+}
+
+# writer of each results file, and the record of what the results were extracted from
+RESULT_WRITERS = {'.tsv': TsvWriter, '.parquet': ParquetWriter, '.db': SqliteWriter}
+RESULTS_MANIFEST = 'swbd_errors.files.json'
+
+# (column, has eos score) pairs verified against the gold length of names
+BASE_CHECKS = [('sentence_dtok', False)]
+MODEL_CHECKS = {
+	'tags': [('tags', False), ('shapes', False)],
+	'ngram': [('scores-ngram', True)],
+	'nn': [('scores-gru', True)],
+}
+VERIFY_CHECKS = BASE_CHECKS + MODEL_CHECKS['tags'] + MODEL_CHECKS['ngram'] + MODEL_CHECKS['nn']
+MISMATCH_COLS = ['index', 'column', 'expected', 'actual']
+
+# files whose empty utterances have the wrong turn, see label_empty_turns
+PROBLEM_FILES = ["sw4103.trans", "sw4108.trans", "sw4171.trans", "sw4329.trans", "sw4617.trans"]
+
+_STR_ITEM = re.compile(r"'((?:[^'\\]|\\.)*)'|\"((?:[^\"\\]|\\.)*)\"")
+
+
+def _str_items(cell):
+	cell = cell.strip()
+	if cell == '[]':
+		return []
+	if '"' not in cell and '\\' not in cell:
+		# no item holds a quote, so python's list repr splits cleanly on the separator
+		return cell[2:-2].split("', '")
+	found = _STR_ITEM.findall(cell)
+	if '\\' not in cell:
+		return [single or double for single, double in found]
+	# escaped characters are rare, let python undo them
+	return [literal_eval("'" + single + "'") if single or not double else literal_eval('"' + double + '"')
+			for single, double in found]
+
+
+def parse_ragged(cells, kind):
+	"""Parses a column of list-encoded cells such as "['a', 'b']" or "[0.1, 0.2]"
+	into a Ragged of typed values, without evaluating each cell."""
+	cells = [x if isinstance(x, str) else '[]' for x in cells]
+	if kind == STR_LIST:
+		return Ragged.from_lists([_str_items(x) for x in cells])
+
+	dtype = np.float64 if kind == FLOAT_LIST else np.int64
+	bodies = [x.strip()[1:-1].strip() for x in cells]
+	lengths = np.fromiter((x.count(',') + 1 if x else 0 for x in bodies), dtype=np.int64, count=len(bodies))
+	offsets = np.zeros(len(bodies) + 1, dtype=np.int64)
+	np.cumsum(lengths, out=offsets[1:])
+	text = ','.join(x for x in bodies if x).replace("'", '').replace('"', '')
+	values = np.array(text.split(',') if text else [], dtype=str).astype(dtype)
+	return Ragged(values, offsets)
+
+
+def parse_lists(cells, kind):
+	"""Same as parse_ragged but returns a list of Python lists per cell."""
+	if kind == STR_LIST:
+		return [_str_items(x) if isinstance(x, str) else [] for x in cells]
+	return parse_ragged(cells, kind).to_lists()
+
+
+def read_tsv(tsv_file, header=0, schema=None):
+	"""Given a tsv file reads and returns as pandas dataframe.
+
+	List columns named in the schema are parsed with their declared type,
+	any other column that looks like a list is evaluated cell by cell."""
+	schema = schema or dict()
+	with profiler.stage('read ' + (os.path.basename(tsv_file) if isinstance(tsv_file, str) else 'rows')):
+		df = pd.read_csv(tsv_file, sep='\t', header=header, quotechar="\"", dtype={k: str for k in schema})
+		profiler.count('rows', len(df))
+		return parse_columns(df, schema, list_columns(df, schema))
+
+
+def iter_tsv(tsv_file, chunksize, header=0, schema=None, usecols=None):
+	"""Reads a tsv file in dataframes of chunksize rows, leaving the list
+	columns as text for parse_columns.  usecols limits the columns read."""
+	schema = schema or dict()
+	return pd.read_csv(tsv_file, sep='\t', header=header, quotechar="\"", dtype={k: str for k in schema},
+					   chunksize=chunksize, usecols=usecols)
+
+
+def group_lines(lines):
+	"""Header and rows of tsv text grouped by conversation (the 'file'
+	column), in order of first appearance.  The groups are None if the rows
+	of a conversation are not contiguous."""
+	lines = iter(lines)
+	header = next(lines, '')
+	col = header.rstrip('\r\n').split('\t').index('file')
+	groups = dict()
+	last = None
+	for line in lines:
+		key = line.split('\t', col + 1)[col]
+		if key != last:
+			if key in groups:
+				return header, None
+			groups[key] = list()
+			last = key
+		groups[key].append(line)
+	return header, groups
+
+
+def conversation_lines(tsv_file):
+	with open(tsv_file, newline='') as f:
+		return group_lines(f)
+
+
+def index_conversations(f):
+	"""[sha1, start, end] of the rows of each conversation of a binary tsv
+	file, over their byte range, in order of first appearance.  None if the
+	rows of a conversation are not contiguous."""
+	header = f.readline()
+	col = header.decode('utf-8').rstrip('\r\n').split('\t').index('file')
+	groups = dict()
+	pos = len(header)
+	last = h = None
+	for line in f:
+		key = line.split(b'\t', col + 1)[col].decode('utf-8')
+		if key != last:
+			if key in groups:
+				return None
+			if last is not None:
+				groups[last][0] = h.hexdigest()
+			groups[key] = [None, pos, pos]
+			last, h = key, hashlib.sha1()
+		h.update(line)
+		pos += len(line)
+		groups[key][2] = pos
+	if last is not None:
+		groups[last][0] = h.hexdigest()
+	return groups
+
+
+def read_ranges(path, ranges):
+	"""Header and the given [sha1, start, end] byte ranges of a file."""
+	buffer = io.BytesIO()
+	with open(path, 'rb') as f:
+		buffer.write(f.readline())
+		for _, start, end in ranges:
+			f.seek(start)
+			buffer.write(f.read(end - start))
+	profiler.count('bytes', buffer.tell())
+	buffer.seek(0)
+	return buffer
+
+
+def fingerprint(*parts):
+	"""sha1 of some strings and lists of lines."""
+	h = hashlib.sha1()
+	for part in parts:
+		for line in [part] if isinstance(part, str) else part:
+			h.update(line.encode('utf-8'))
+		h.update(b'\0')
+	return h.hexdigest()
+
+
+def list_columns(df, schema):
+	"""Columns outside the schema whose first value looks like a list."""
+	return [col_name for col_name in df.columns if col_name not in schema and
+			str(df.iloc[0][col_name]).startswith('[') and str(df.iloc[0][col_name]).endswith(']')]
+
+
+def parse_columns(df, schema, evaluated):
+	"""Parses the schema columns with their declared type and evaluates the others given."""
 	# convert strings of lists to lists
 	for col_name in df.columns:
-		if str(df.iloc[0][col_name]).startswith('[') and \
-			str(df.iloc[0][col_name]).endswith(']'):
+		if col_name in schema:
+			df[col_name] = parse_lists(df[col_name].tolist(), schema[col_name])
+		elif col_name in evaluated:
 			df[col_name] = df[col_name].apply(lambda x: literal_eval(x))
-			
 	return df
 
 
-def get_gold_len(names):
-	result = [(not x.endswith('_a') and not x == 'None') for x in names]
-	return sum(result)
+def row_sums(lists, mask):
+	"""Sum of a mask over the flattened values of a Ragged, per row."""
+	total = np.zeros(len(lists.values) + 1, dtype=np.int64)
+	np.cumsum(mask, out=total[1:])
+	return total[lists.offsets[1:]] - total[lists.offsets[:-1]]
 
 
-def verify_len(ix, tokens, gold_len, sym=False, eos=False):
-	token_len = len(tokens)
+def gold_lengths(names):
+	"""Number of names of each row that are not '_a' halves or 'None', counted
+	over the flattened names of all rows at once."""
+	names = Ragged.from_lists(names)
+	if not len(names.values):
+		return names.lengths()
+	return row_sums(names, ~(np.char.endswith(names.values, '_a') | (names.values == 'None')))
 
-	if eos:
-		token_len -= 1
 
-	try:
-		assert token_len == gold_len
-	except AssertionError as e:
-		print('LENGTH MISMATCH: {}'.format(ix))
-		print('-gold length: {}'.format(gold_len))
-		print('-tokens: {}'.format(tokens))
+def list_lengths(column):
+	return np.fromiter(map(len, column), dtype=np.int64, count=len(column))
 
 
-def verify(align):
+@profiler.stage('verify')
+def verify(align, checks=None):
+	"""Checks the length of each (column, has eos score) pair against the gold
+	length of names, for both ptb and ms.  Returns the mismatches as a frame of
+	MISMATCH_COLS, with the expected length counting the eos score."""
+	checks = checks or VERIFY_CHECKS
+	profiler.count('rows', len(align))
+	mismatches = list()
 	for prefix in ['', 'ms_']:
-		print('checking {}'.format('ptb' if prefix == '' else 'ms'))
-		gold_len = prefix + 'len'
-		names = prefix + 'names'
-		align[gold_len] = align[names].apply(lambda x: get_gold_len(x))
-
-		dtok = prefix + 'sentence_dtok'
-		align.apply(lambda x: verify_len(x.name, x[dtok], x[gold_len]), axis=1)
-		tag = prefix + 'tags'
-		align.apply(lambda x: verify_len(x.name, x[tag], x[gold_len]), axis=1)
-		shape = prefix + 'shapes'
-		align.apply(lambda x: verify_len(x.name, x[shape], x[gold_len]), axis=1)
-		ngram = prefix + 'scores-ngram'
-		align.apply(lambda x: verify_len(x.name, x[ngram], x[gold_len], eos=True), axis=1)
-		gru = prefix + 'scores-gru'
-		align.apply(lambda x: verify_len(x.name, x[gru], x[gold_len], eos=True), axis=1)
-		align.drop([gold_len], axis=1, inplace=True)
+		gold = gold_lengths(align[prefix + 'names'].tolist())
+		for col, eos in checks:
+			col = prefix + col
+			expected = gold + int(eos)
+			actual = list_lengths(align[col].tolist())
+			bad = np.flatnonzero(actual != expected)
+			mismatches.append(pd.DataFrame({'index': align.index[bad], 'column': col,
+											'expected': expected[bad], 'actual': actual[bad]}, columns=MISMATCH_COLS))
+	mismatches = pd.concat(mismatches, ignore_index=True)
+	profiler.count('mismatches', len(mismatches))
+	return mismatches
+
+
+def log_mismatches(mismatches, logger):
+	if len(mismatches):
+		logger.warning('Length mismatches: {}'.format(mismatches['column'].value_counts(sort=False).to_dict()))
+		logger.debug('\n' + mismatches.to_csv(sep='\t', index=False))
 
 
 def generate_index(df):
@@ -79,26 +278,64 @@ def get_turn_num(token):
 	return int(token.split("_")[0][3:])
 
 
-def label_empty_turns(df):
-	problem_turn = ["sw4103.trans", "sw4108.trans", "sw4171.trans", "sw4329.trans", "sw4617.trans"]
-	for i, row in df.iterrows():
-		if row['file'] in problem_turn:
-			if not set(row['ms_names']) == {'None'} and \
-				set(row['names']) == {'None'}:
-				# use ms names
-				turn_toks = get_turn_num(row['ms_names'][0])
-			elif set(row['ms_names']) == {'None'} and \
-				not set(row['names']) == {'None'}:
-				# use ptb names
-				turn_toks = get_turn_num(row['names'][0])
-			else:
-				# completely empty case
-				turn_toks = int(df.loc[i - 1, 'turn']) + 1
-			if row['turn'] != turn_toks:
-				df.loc[i, 'turn'] = turn_toks
+def get_turn_nums(tokens):
+	"""get_turn_num of each token."""
+	return pd.Series(tokens, dtype=object).str.split('_').str[0].str[3:].astype(np.int64).to_numpy()
+
+
+def all_none(names):
+	"""Whether each row of a Ragged of names is non-empty and only 'None'."""
+	lengths = names.lengths()
+	if not len(names.values):
+		return np.zeros(len(names), dtype=bool)
+	return (lengths > 0) & (row_sums(names, names.values == 'None') == lengths)
+
+
+@profiler.stage('label empty turns')
+def label_empty_turns(df, problem_files=PROBLEM_FILES):
+	"""Fixes the turn of the utterances of the problem files.  When only one
+	side's names are empty ('None') the turn comes from the other side's first
+	name, any other utterance follows the turn of the row before it."""
+	rows = np.flatnonzero(df['file'].isin(problem_files).to_numpy())
+	if not len(rows):
+		return df
+	ptb = Ragged.from_lists(df['names'].iloc[rows].tolist())
+	ms = Ragged.from_lists(df['ms_names'].iloc[rows].tolist())
+	ptb_empty, ms_empty = all_none(ptb), all_none(ms)
+	use_ms = ptb_empty & ~ms_empty
+	use_ptb = ms_empty & ~ptb_empty
+	# the side a turn is taken from needs a name, as the row-wise version did
+	missing = (use_ms & (ms.lengths() == 0)) | (use_ptb & (ptb.lengths() == 0))
+	if missing.any():
+		raise IndexError('No names to take the turn from in rows: {}'.format(rows[missing].tolist()))
+
+	turns = df['turn'].to_numpy()
+	fixed = turns.copy()
+	fixed[rows[use_ms]] = get_turn_nums(ms.values[ms.offsets[:-1][use_ms]])
+	fixed[rows[use_ptb]] = get_turn_nums(ptb.values[ptb.offsets[:-1][use_ptb]])
+
+	# completely empty case, forward from the last row that is not one
+	follow = np.zeros(len(df), dtype=bool)
+	follow[rows[~(use_ms | use_ptb)]] = True
+	anchor = np.maximum.accumulate(np.where(follow, -1, np.arange(len(df))))
+	follow &= anchor >= 0
+	fixed[follow] = fixed[anchor[follow]] + (np.flatnonzero(follow) - anchor[follow])
+
+	profiler.count('relabeled', int((fixed != turns).sum()))
+	df['turn'] = fixed
 	return df
 
 
+@profiler.stage('pointers')
+def add_pointers(align):
+	"""Adds the extraction pointers before each alignment token, and after the
+	last, as 'ix_<pointer>' list columns (see columnar.pointer_tables)."""
+	cols = {col: Ragged.from_lists(align[col].tolist()) for col in ['comb_ann', 'names', 'ms_names']}
+	for k, table in pointer_tables(cols).items():
+		align['ix_' + k] = table.to_lists()
+	return align
+
+
 def read_metadata(metadata_file):
 	df = pd.read_csv(metadata_file, header=0)
 	df.index = df['FILE']
@@ -110,108 +347,506 @@ def read_metadata(metadata_file):
 
 def merge_score(alignments, file):
 	col_name = os.path.splitext(os.path.basename(file))[0]
-	temp_df = read_tsv(file)
+	temp_df = read_tsv(file, schema=SCORES_SCHEMA)
 	temp_df = generate_index(temp_df)
 	temp_df.rename(columns={'scores': col_name,}, inplace=True)
 	df = alignments.join(temp_df[col_name])
 	return df
 
 
-def merge_models(align, config, logger):
+def model_files(config):
+	"""The ptb and ms files of each artifact merged onto the alignments."""
 	data_path = os.path.join(config['project_dir'], 'data')
-	ptb_tags_file = os.path.join(data_path, 'swbd_ptb_tags.tsv')
-	ms_tags_file = os.path.join(data_path, 'swbd_ms_tags.tsv')
-	ptb_ngram_file = os.path.join(data_path, 'swbd_ptb_ngram_scores.tsv')
-	ms_ngram_file = os.path.join(data_path, 'swbd_ms_ngram_scores.tsv')
-	ptb_gru_file = os.path.join(data_path, 'swbd_ptb_' + config['nnmodel'] + '_scores.tsv')
-	ms_gru_file = os.path.join(data_path, 'swbd_ms_' + config['nnmodel'] + '_scores.tsv')
-
-	ptb_tags = read_tsv(ptb_tags_file)
-	ms_tags = read_tsv(ms_tags_file)
-	ms_tags.rename(columns={'tags': 'ms_tags', 'shapes': 'ms_shapes'}, inplace=True)
-	ptb_ngram = read_tsv(ptb_ngram_file)
-	ptb_ngram.rename(columns={'scores': 'scores-ngram'}, inplace=True)
-	ms_ngram = read_tsv(ms_ngram_file)
-	ms_ngram.rename(columns={'scores': 'ms_scores-ngram'}, inplace=True)
-	ptb_gru = read_tsv(ptb_gru_file)
-	ptb_gru.rename(columns={'scores': 'scores-gru'}, inplace=True)
-	ms_gru = read_tsv(ms_gru_file)
-	ms_gru.rename(columns={'scores': 'ms_scores-gru'}, inplace=True)
-
-	ix_cols = ['file', 'speaker', 'turn', 'sent_num']
-	logger.info('Size before merge: {}'.format(str(align.shape[0])))
-	align = align.merge(ptb_tags, on=ix_cols)
-	align = align.merge(ms_tags, on=ix_cols)
-	logger.info('Size after tag merge: {}'.format(str(align.shape[0])))
-	align = align.merge(ptb_ngram, on=ix_cols)
-	logger.info('Size after ptb ngram merge: {}'.format(str(align.shape[0])))
-	align = align.merge(ms_ngram, on=ix_cols)
-	logger.info('Size after ms ngram merge: {}'.format(str(align.shape[0])))
-	align = align.merge(ptb_gru, on=ix_cols)
-	logger.info('Size after ptb gru merge: {}'.format(str(align.shape[0])))
-	align = align.merge(ms_gru, on=ix_cols)
-	logger.info('Size after ms gru merge: {}'.format(str(align.shape[0])))
+	files = {
+		'tags': [os.path.join(data_path, 'swbd_ptb_tags.tsv'),
+				 os.path.join(data_path, 'swbd_ms_tags.tsv')],
+		'ngram': [os.path.join(data_path, 'swbd_ptb_ngram_scores.tsv'),
+				  os.path.join(data_path, 'swbd_ms_ngram_scores.tsv')],
+	}
+	# the first nn model is 'nn', any others are merged as 'nn-<model>'
+	for i, model in enumerate(util.get_models(config)):
+		name = 'nn' if i == 0 else 'nn-' + model
+		files[name] = [os.path.join(data_path, 'swbd_ptb_' + model + '_scores.tsv'),
+					   os.path.join(data_path, 'swbd_ms_' + model + '_scores.tsv')]
+	return files
+
+
+def model_columns(name):
+	"""Names of an artifact's ptb columns, keyed by their names in its files."""
+	if name.startswith('nn-'):
+		return {'scores': 'scores-' + name[3:]}
+	return MODEL_COLUMNS[name]
+
+
+def model_checks(name):
+	if name.startswith('nn-'):
+		return [('scores-' + name[3:], True)]
+	return MODEL_CHECKS[name]
+
+
+def model_schema(name):
+	return TAGS_SCHEMA if name == 'tags' else SCORES_SCHEMA
+
+
+def name_model(name, ptb, ms):
+	"""Names the columns of an artifact's ptb and ms tables."""
+	columns = model_columns(name)
+	ptb.rename(columns=columns, inplace=True)
+	ms.rename(columns={k: 'ms_' + v for k, v in columns.items()}, inplace=True)
+	return ptb, ms
+
+
+def read_model(name, files):
+	"""Reads the ptb and ms files of an artifact and names their columns."""
+	return name_model(name, *[read_tsv(x, schema=model_schema(name)) for x in files])
+
+
+class KeyIndex:
+	"""Hash index over the key columns of the alignments, built once and
+	shared by every artifact joined onto them."""
+
+	def __init__(self, align):
+		self.index = pd.MultiIndex.from_frame(align[IX_COLS])
+		self.size = len(align)
+		self.unique = self.index.is_unique
+
+	def lookup(self, df):
+		"""Alignment row of each row of df, -1 where its key is missing."""
+		return self.index.get_indexer(pd.MultiIndex.from_frame(df[IX_COLS]))
+
+
+def join_model(index, matched, name, tables, logger):
+	"""Attaches an artifact's ptb and ms columns (see read_model) by positional
+	lookup in the key index.  Rows missing from either are cleared in matched.
+	A key found more than once raises ValueError rather than repeating the
+	alignment row, as a merge on the keys would."""
+	columns = dict()
+	for dtype, df in zip(('ptb', 'ms'), tables):
+		pos = index.lookup(df)
+		found = pos >= 0
+		rows = np.zeros(index.size, dtype=bool)
+		rows[pos[found]] = True
+		if len(np.unique(pos[found])) < found.sum():
+			raise ValueError(duplicate_keys(df, dtype, name))
+		if not found.all():
+			logger.info('{} {} keys not in alignments: {}'.format(dtype, name, str((~found).sum())))
+		matched &= rows
+		logger.info('Size after {} {} merge: {}'.format(dtype, name, str(matched.sum())))
+
+		for col in df.columns.drop(IX_COLS):
+			values = np.full(index.size, None, dtype=object)
+			values[pos[found]] = df[col].to_numpy()[found]
+			columns[col] = values
+	return columns
+
+
+def duplicate_keys(df, dtype, name):
+	"""Error message naming the first keys of df that appear more than once."""
+	keys = df.loc[df.duplicated(IX_COLS, keep=False), IX_COLS].drop_duplicates()
+	return 'Duplicate {} {} keys, e.g. {}'.format(dtype, name, keys.head(3).to_dict('records'))
+
+
+def merge_model(align, name, tables, logger):
+	ptb, ms = tables
+	align = align.merge(ptb, on=IX_COLS)
+	logger.info('Size after ptb {} merge: {}'.format(name, str(align.shape[0])))
+	align = align.merge(ms, on=IX_COLS)
+	logger.info('Size after ms {} merge: {}'.format(name, str(align.shape[0])))
 	return align
 
 
-def preprocess(config, logger):
-	# load files
-	alignments_file = os.path.join(config['project_dir'], 'data', config['alignments_file'])
-	logger.info('Loading {}'.format(alignments_file))
-	align = read_tsv(alignments_file)
+def merge_models(align, config, logger):
+	files = model_files(config)
+	logger.info('Size before merge: {}'.format(str(align.shape[0])))
+	index = KeyIndex(align)
+	if not index.unique:
+		logger.warning('Alignment keys are not unique, merging instead of joining')
+		for name in files:
+			align = merge_model(align, name, read_model(name, files[name]), logger)
+		return align
+
+	matched = np.ones(len(align), dtype=bool)
+	columns = dict()
+	for name in files:
+		with profiler.stage('merge ' + name):
+			columns.update(join_model(index, matched, name, read_model(name, files[name]), logger))
+	align = align.loc[matched].reset_index(drop=True)
+	for col, values in columns.items():
+		align[col] = values[matched]
+	return align
+
 
-	metadata_file = os.path.join(config['project_dir'], 'data', 'metadata.csv')
-	logger.info('Loading {}'.format(metadata_file))
-	transcribers = read_metadata(metadata_file)
+def cache_keys(config, cache):
+	"""Keys of every cached artifact, from the hashes of their input files."""
+	data_path = os.path.join(config['project_dir'], 'data')
+	alignments_file = os.path.join(data_path, config['alignments_file'])
+	metadata_file = os.path.join(data_path, 'metadata.csv')
+	keys = {'base': cache.key([alignments_file, metadata_file])}
+	files = model_files(config)
+	for name in files:
+		keys[name] = cache.key(keys['base'], name, files[name])
+	problem_files = {'problem_files': sorted(config.get('problem_files', PROBLEM_FILES))}
+	keys['corpus'] = cache.key(*[keys[x] for x in ['base'] + list(files)], problem_files)
+	return keys
+
+
+def cache_slots(config):
+	"""Slot of each cached artifact (see Cache.keep), from its name and the
+	input paths and settings, not the file contents, it is built for."""
+	data_path = os.path.join(config['project_dir'], 'data')
+	files = model_files(config)
+	settings = {'base': [os.path.join(data_path, config['alignments_file']), os.path.join(data_path, 'metadata.csv')]}
+	settings.update(files)
+	settings['corpus'] = [settings[x] for x in settings] + [sorted(config.get('problem_files', PROBLEM_FILES))]
+	return {name: name + '-' + fingerprint(json.dumps(value))[:16] for name, value in settings.items()}
+
+
+@profiler.stage('build base')
+def build_base(config, logger, align=None, transcribers=None):
+	"""Alignments with their transcriber, before any tags or scores are merged.
+	The alignments and transcribers are read from the project's files unless given."""
+	if align is None:
+		alignments_file = os.path.join(config['project_dir'], 'data', config['alignments_file'])
+		logger.info('Loading {}'.format(alignments_file))
+		align = read_tsv(alignments_file, schema=ALIGNMENT_SCHEMA)
+	if transcribers is None:
+		metadata_file = os.path.join(config['project_dir'], 'data', 'metadata.csv')
+		logger.info('Loading {}'.format(metadata_file))
+		transcribers = read_metadata(metadata_file)
 
 	# add transcriber info
 	align['transcriber'] = align['file'].apply(lambda x: transcribers[x])
-
-	# merge the scores and tags
-	logger.info('Merging scores and tags to alignments')
 	align['file_num'] = align['file'].astype(str).str.slice(2, -6)
-	align = merge_models(align, config, logger)
+
+	logger.info('Verify indices of tokens')
+	log_mismatches(verify(align, BASE_CHECKS), logger)
+	return align
+
+
+def build_model(base, index, name, tables, logger):
+	"""Merges one artifact's ptb and ms tables (see read_model) onto the base
+	alignments.  Rows are kept by their position in base under '_row' so the
+	artifact can be cached on its own."""
+	logger.info('Merging {} to alignments'.format(name))
+	if index.unique:
+		matched = np.ones(len(base), dtype=bool)
+		columns = join_model(index, matched, name, tables, logger)
+		part = pd.DataFrame({'_row': np.flatnonzero(matched)})
+		for col, values in columns.items():
+			part[col] = values[matched]
+	else:
+		logger.warning('Alignment keys are not unique, merging instead of joining')
+		keys = base[IX_COLS].copy()
+		keys['_row'] = np.arange(len(base))
+		part = merge_model(keys, name, tables, logger)
+		if part['_row'].duplicated().any():
+			raise ValueError('Duplicate {} keys: {}'.format(name, str(part['_row'].duplicated().sum())))
+		part = part.drop(IX_COLS, axis=1).reset_index(drop=True)
+
+	profiler.count('rows', len(part))
 
 	# make sure all the lengths of tags and scores match the index
-	logger.info('Verify indices of tags and scores')
-	verify(align)
+	logger.info('Verify indices of {}'.format(name))
+	check = part.copy()
+	check.index = part['_row']
+	check['names'] = base['names'].iloc[part['_row']].tolist()
+	check['ms_names'] = base['ms_names'].iloc[part['_row']].tolist()
+	log_mismatches(verify(check, model_checks(name)), logger)
+	return part
+
+
+@profiler.stage('assemble')
+def assemble(base, parts):
+	"""Joins the cached artifacts on the base rows they all share."""
+	rows = np.arange(len(base))
+	for part in parts:
+		rows = np.intersect1d(rows, part['_row'].to_numpy())
+	align = base.iloc[rows].reset_index(drop=True)
+	profiler.count('rows', len(align))
+	for part in parts:
+		part = part.set_index('_row').loc[rows]
+		for col in part.columns:
+			align[col] = part[col].tolist()
+	return align
+
+
+@profiler.stage('build')
+def build_corpus(config, logger):
+	"""Builds the merged corpus, reusing every cached artifact whose inputs are
+	unchanged.  The files of the others are all loaded concurrently and each
+	artifact is merged as soon as its files are parsed.  Also returns the
+	conversation index (see index_conversations) of each file read."""
+	cache = Cache(config['project_dir'])
+	keys = cache_keys(config, cache)
+	files = model_files(config)
+	cached = [name for name in files if cache.has(name, keys[name])]
+	base_cached = cache.has('base', keys['base'])
+	data_path = os.path.join(config['project_dir'], 'data')
+
+	with Loader(load_jobs(config, 2 * (len(files) - len(cached)) + (0 if base_cached else 2))) as loader:
+		pending = dict()
+		for name in files:
+			if name not in cached:
+				logger.info('Loading {}'.format(', '.join(files[name])))
+				for path in files[name]:
+					pending[loader.submit(path, read_tsv, 0, model_schema(name), index=index_conversations)] = name
+
+		if base_cached:
+			logger.info('Using cached alignments {}'.format(cache.path('base', keys['base'])))
+			base = cache.load('base', keys['base']).to_frame().reset_index(drop=True)
+		else:
+			alignments_file = os.path.join(data_path, config['alignments_file'])
+			logger.info('Loading {}'.format(alignments_file))
+			align = loader.submit(alignments_file, read_tsv, 0, ALIGNMENT_SCHEMA, index=index_conversations)
+			transcribers = loader.submit(os.path.join(data_path, 'metadata.csv'), read_metadata)
+			base = build_base(config, logger, loader.result(align), loader.result(transcribers))
+			cache.save('base', keys['base'], base)
+
+		parts = dict()
+		for name in cached:
+			logger.info('Using cached {} {}'.format(name, cache.path(name, keys[name])))
+			parts[name] = cache.load(name, keys[name]).to_frame().reset_index(drop=True)
+
+		# each artifact is merged once both its files are in, in whichever order they finish
+		index = KeyIndex(base) if pending else None
+		loaded = defaultdict(dict)
+		for future in as_completed(pending):
+			name = pending[future]
+			loaded[name][future] = loader.result(future)
+			if len(loaded[name]) < 2:
+				continue
+			tables = [loaded[name][x] for x in pending if pending[x] == name]
+			with profiler.stage('merge ' + name):
+				parts[name] = build_model(base, index, name, name_model(name, *tables), logger)
+			cache.save(name, keys[name], parts[name])
+
+	align = assemble(base, [parts[name] for name in files])
+	logger.info('Size after merge: {}'.format(str(align.shape[0])))
+	return add_pointers(align), loader.indexes
+
+
+def load_jobs(config, files):
+	"""Processes to parse input files on, from load_jobs in the config or one
+	per file up to the number of cpus."""
+	return config.get('load_jobs', min(files, os.cpu_count() or 1))
+
+
+def input_files(config):
+	"""Every input file of the corpus but the metadata: the alignments, then
+	the ptb and ms files of each artifact."""
+	files = [os.path.join(config['project_dir'], 'data', config['alignments_file'])]
+	for pair in model_files(config).values():
+		files += pair
+	return files
+
+
+@profiler.stage('fingerprint')
+def conversation_fingerprints(config, cache, known):
+	"""Fingerprint of each conversation of the alignments, over the sha1 of
+	its rows in every input file, its transcriber and whether it is a
+	problem file (then also over the fingerprint of the conversation before
+	it), and the sha1 and conversation index of each input file.  An index
+	is taken from known if the file is unchanged, otherwise the file is
+	streamed.  The fingerprints are None if the rows of a conversation are
+	not contiguous in some file."""
+	files = dict()
+	for path in input_files(config):
+		sha1 = cache.file_hash(path)
+		if known.get(path, dict()).get('sha1') != sha1:
+			with open(path, 'rb') as f:
+				known[path] = {'sha1': sha1, 'groups': index_conversations(f)}
+			profiler.count('bytes', os.path.getsize(path))
+		files[path] = known[path]
+	if any(x['groups'] is None for x in files.values()):
+		return None, files
+	transcribers = read_metadata(os.path.join(config['project_dir'], 'data', 'metadata.csv'))
+	problem_files = set(config.get('problem_files', PROBLEM_FILES))
+	settings = json.dumps([CACHE_VERSION, list(model_files(config))])
+
+	alignments = files[input_files(config)[0]]['groups']
+	fingerprints = dict()
+	last = ''
+	for conv in alignments:
+		# the first turns of a problem file can follow the last row of the
+		# conversation before it (see label_empty_turns), so it changes with it
+		before = last if conv in problem_files else ''
+		fingerprints[conv] = fingerprint(settings, str(transcribers.get(conv)), str(conv in problem_files), before,
+										 *[x['groups'].get(conv, [''])[0] for x in files.values()])
+		last = fingerprints[conv]
+	return fingerprints, files
+
+
+@profiler.stage('update')
+def update_corpus(config, cache, last_key, last, fingerprints, files, logger):
+	"""The corpus saved under last_key with only the conversations whose
+	fingerprint changed from last merged again, or None if most changed."""
+	if fingerprints is None:
+		return None
+	changed = [conv for conv in fingerprints if last.get(conv) != fingerprints[conv]]
+	if len(changed) > len(fingerprints) / 2:
+		return None
+	logger.info('Conversations changed: {} of {}'.format(len(changed), len(fingerprints)))
+
+	old = cache.load('corpus', last_key)
+	unchanged = [conv for conv in fingerprints if conv not in changed]
+	align = old.take(np.flatnonzero(np.isin(old['file'], unchanged))).to_frame().reset_index(drop=True)
+	if changed:
+		# only the changed conversations' rows of each input file are read
+		text = {path: read_ranges(path, [x['groups'][conv] for conv in changed if conv in x['groups']])
+				for path, x in files.items()}
+		inputs = input_files(config)
+		base = build_base(config, logger, read_tsv(text[inputs[0]], schema=ALIGNMENT_SCHEMA))
+		index = KeyIndex(base)
+		parts = list()
+		for name, pair in model_files(config).items():
+			with profiler.stage('merge ' + name):
+				parts.append(build_model(base, index, name, read_model(name, [text[x] for x in pair]), logger))
+		new = add_pointers(assemble(base, parts))
+		align = pd.concat([align, new[align.columns]], ignore_index=True)
+
+	# back in the order of the alignments
+	order = {conv: i for i, conv in enumerate(fingerprints)}
+	align = align.iloc[np.argsort(align['file'].map(order).to_numpy(), kind='stable')]
+	return align.reset_index(drop=True)
+
+
+@profiler.stage('preprocess')
+def preprocess(config, logger):
+	"""Builds the merged corpus.  If only some conversations changed since the
+	last build for these settings, only they are merged again, otherwise
+	every artifact whose inputs changed is.  The conversations are only
+	fingerprinted from the files a full build reads, or when an update is
+	possible."""
+	cache = Cache(config['project_dir'])
+	keys = cache_keys(config, cache)
+	slots = cache_slots(config)
+	last_key, last, known = cache.last_fingerprints(slots['corpus'])
+	fingerprints = files = align = None
+	if last is not None and cache.has('corpus', last_key):
+		fingerprints, files = conversation_fingerprints(config, cache, known)
+		align = update_corpus(config, cache, last_key, last, fingerprints, files, logger)
+	if align is None:
+		align, indexes = build_corpus(config, logger)
+		if files is None:
+			for path, groups in indexes.items():
+				known[path] = {'sha1': cache.file_hash(path), 'groups': groups}
+			fingerprints, files = conversation_fingerprints(config, cache, known)
 
 	# fix turns that have empty label
-	align = label_empty_turns(align)
+	align = label_empty_turns(align, config.get('problem_files', PROBLEM_FILES))
 
 	# make a pretty index
 	align = generate_index(align)
 	logger.info(align.head())
 
-	logger.debug('data.P info...')
+	logger.debug('corpus info...')
 	logger.debug(align.columns)
 	logger.debug(align.shape)
 
-	output = os.path.join(config['project_dir'], 'data.P')
-	align.to_pickle(output)
-	logger.info('Data written to: {}'.format(output))
+	cache.save('corpus', keys['corpus'], align)
+	if fingerprints is not None:
+		cache.save_fingerprints(slots['corpus'], keys['corpus'], fingerprints, files)
+	# whatever these artifacts supersede for the same settings would only pile up
+	cache.keep({slots[name]: [name, keys[name]] for name in slots})
+	logger.info('Data written to: {}'.format(cache.path('corpus', keys['corpus'])))
 	return align
 	
 	
+@profiler.stage('load')
 def load_data(config, logger):
-	data_file = os.path.join(config['project_dir'], 'data.P')
-
-	if os.path.exists(data_file):
-		logger.info('Loading {}'.format(data_file))
-		alignments = pickle.load(open(data_file, 'rb'))
-		return alignments
-	else:
-		return preprocess(config, logger)
+	"""Memory-maps the merged corpus, preprocessing whatever changed first."""
+	cache = Cache(config['project_dir'])
+	key = cache_keys(config, cache)['corpus']
+
+	if not cache.has('corpus', key):
+		preprocess(config, logger)
+	cache.save_memo()
+	logger.info('Loading {}'.format(cache.path('corpus', key)))
+	return cache.load('corpus', key)
+
+
+def result_files(config):
+	"""Path of each results file the config enables."""
+	output = os.path.join(config['project_dir'], 'swbd_errors')
+	files = [output + '.tsv']
+	if config.get('parquet'):
+		files.append(output + '.parquet')
+	if config.get('sqlite'):
+		files.append(output + '.db')
+	return files
+
+
+def open_results(config, logger, models=(), previous=False):
+	"""Result sink writing to swbd_errors.tsv, swbd_errors.parquet if parquet
+	is set in the config and the indexed swbd_errors.db if sqlite is.  With
+	previous the existing results are moved aside first, so the sink can copy
+	conversations from them."""
+	writers = list()
+	for path in result_files(config):
+		writer = RESULT_WRITERS[os.path.splitext(path)[1]]
+		old = None
+		if previous:
+			old = path + '.prev'
+			os.replace(path, old)
+		try:
+			writers.append(writer(path, models, old))
+		except BaseException:
+			restore(path, old)
+			ResultSink(writers).abort()
+			raise
+		logger.info('Writing results file to {}'.format(path))
+	return ResultSink(writers, config.get('batch_size', BATCH_SIZE))
+
+
+def corpus_fingerprints(config):
+	"""Per-conversation fingerprints of the current corpus, None if unknown."""
+	cache = Cache(config['project_dir'])
+	key, fingerprints, _ = cache.last_fingerprints(cache_slots(config)['corpus'])
+	return fingerprints if key == cache_keys(config, cache)['corpus'] else None
+
+
+def results_settings(config, models, top_n_file):
+	"""Everything besides the corpus that the results depend on."""
+	with open(top_n_file, 'rb') as f:
+		top_n = hashlib.sha1(f.read()).hexdigest()
+	return {'version': CACHE_VERSION, 'models': list(models), 'top_n': top_n,
+			'files': [os.path.basename(x) for x in result_files(config)]}
+
+
+def changed_conversations(config, settings, fingerprints):
+	"""Conversations whose fingerprint changed since the results were last
+	written with the same settings, None if every one has to be extracted."""
+	manifest = os.path.join(config['project_dir'], RESULTS_MANIFEST)
+	if fingerprints is None or not os.path.exists(manifest) or \
+			not all(os.path.exists(x) for x in result_files(config)):
+		return None
+	with open(manifest, 'r') as f:
+		last = json.load(f)
+	if last['settings'] != settings:
+		return None
+	return {conv for conv in fingerprints if last['conversations'].get(conv) != fingerprints[conv]}
+
+
+def clear_results_manifest(config):
+	"""Forgets what the results were extracted from, while they are rewritten."""
+	manifest = os.path.join(config['project_dir'], RESULTS_MANIFEST)
+	if os.path.exists(manifest):
+		os.remove(manifest)
+
+
+def save_results_manifest(config, settings, fingerprints):
+	"""Records what the results were extracted from, once they are written,
+	unless the corpus fingerprints are unknown."""
+	if fingerprints is None:
+		return
+	with open(os.path.join(config['project_dir'], RESULTS_MANIFEST), 'w') as f:
+		json.dump({'settings': settings, 'conversations': fingerprints}, f, indent=1)
 
 
 def write_tsv(config, logger, results):
 	output = os.path.join(config['project_dir'], 'swbd_errors.tsv')
 	
 	logger.info('Writing results file to {}'.format(output))
-	writer = csv.writer(open(output, 'w'), delimiter='\t')
-	
-	# write the header
-	writer.writerow([i for i in itertools.chain(results[0].get_header(), results[0].ptb.get_header('ptb'), results[0].ms.get_header('ms'))])
-
-	for item in results:
-		writer.writerow([i for i in itertools.chain(item.get_values(), item.ptb.get_values(), item.ms.get_values())])
+	writer = TsvWriter(output, results[0].ptb.models)
+	writer.write(results)
+	writer.close()
@@ -10,6 +10,9 @@ from enum import Enum
 import util
 
 
+NON_DISFLUENT = frozenset({'C', 'O'})
+
+
 class Err(Enum):
 	INS = 0
 	DEL = 1
@@ -27,8 +30,12 @@ class Lex(Enum):
 
 
 class Trans:
+	# output columns, in order, before those of any extra nn models
+	FIELDS = ('tokens', 'top_n', 'shapes', 'avg_shape', 'disf', 'disf_current', 'disf_prev', 'disf_next',
+			  'nn_scores', 'ngram_scores', 'ngram_sup', 'nn_sup')
+	__slots__ = FIELDS + ('models', 'extra_scores', 'extra_sups')
 
-	def __init__(self):
+	def __init__(self, models=()):
 		self.tokens = list()
 		self.top_n = None
 		self.shapes = list()
@@ -41,6 +48,10 @@ class Trans:
 		self.ngram_scores = list()
 		self.ngram_sup = None
 		self.nn_sup = None
+		# scores and surprisal of any nn models after the first
+		self.models = tuple(models)
+		self.extra_scores = tuple(list() for _ in self.models)
+		self.extra_sups = (None,) * len(self.models)
 
 	def set_token(self, token, shape, split=False):
 		if not split:
@@ -50,9 +61,16 @@ class Trans:
 		else:
 			self.shapes.append(Lex(int(shape)).name)
 
-	def set_score(self, ngram_value, nn_value):
-		self.ngram_scores.append(ngram_value)
-		self.nn_scores.append(nn_value)
+	def set_score(self, values):
+		"""Adds one token's scores: ngram, nn, then one per extra nn model."""
+		self.ngram_scores.append(values[0])
+		self.nn_scores.append(values[1])
+		for scores, value in zip(self.extra_scores, values[2:]):
+			scores.append(value)
+
+	def get_scores(self):
+		"""Score lists of every model, ngram first."""
+		return [self.ngram_scores, self.nn_scores] + list(self.extra_scores)
 
 	def set_disf(self, d):
 		self.disf.append(d)
@@ -66,8 +84,12 @@ class Trans:
 
 	def _get_surprisal_value(self, other):  # if you are calculating it for PTB, then PTB should be self, MS other
 		if len(self.ngram_scores) > 1:
-			self.ngram_sup = util.get_sup_diff(self.ngram_scores, other.ngram_scores)
-			self.nn_sup = util.get_sup_diff(self.nn_scores, other.nn_scores)
+			self.set_sups(util.get_sup_diffs(self.get_scores(), other.get_scores()))
+
+	def set_sups(self, sups):
+		"""Sets the surprisal difference of every model, ngram first."""
+		self.ngram_sup, self.nn_sup = sups[:2]
+		self.extra_sups = tuple(sups[2:])
 
 	def _check_top_n(self, top_n):
 		if len(self.tokens) == 2 and self.tokens[0] in top_n:
@@ -77,8 +99,7 @@ class Trans:
 
 	def _set_disfluencies(self):
 		if len(self.disf) > 1:
-			nondisf = {'C', 'O'}
-			temp = [x not in nondisf for x in self.disf]
+			temp = [x not in NON_DISFLUENT for x in self.disf]
 			endpoint = len(self.disf)-1
 			if temp[0]:
 				self.disf_prev = True
@@ -87,34 +108,43 @@ class Trans:
 			if temp[endpoint]:
 				self.disf_next = True
 
-	def make_summary(self, top_n, other):
+	def make_summary(self, top_n, other, sup=True):
 		self._summarize_shape()
 		self._set_disfluencies()
 		self._check_top_n(top_n)
-		self._get_surprisal_value(other)
+		if sup:  # otherwise left to surprisal.set_sup_diffs
+			self._get_surprisal_value(other)
 
 	def get_header(self, dtype):
 		if dtype == 'ptb':
 			prefix = ''
 		else:
 			prefix = 'ms_'
-		keys = list(self.__dict__.keys())
+		keys = list(self.FIELDS)
+		for model in self.models:
+			keys += [model + '_scores', model + '_sup']
 		return [prefix + x for x in keys]
 		
 	def get_values(self):
-		return list(self.__dict__.values())
+		values = [getattr(self, x) for x in self.FIELDS]
+		for scores, sup in zip(self.extra_scores, self.extra_sups):
+			values += [scores, sup]
+		return values
 
 
 class ErrSeq:
+	# output columns, in order, before those of the ptb and ms Trans
+	FIELDS = ('index', 'transcriber', 'error_type', 'del_edge', 'types')
+	__slots__ = FIELDS + ('ptb', 'ms')
 
-	def __init__(self):
+	def __init__(self, models=()):
 		self.index = None
 		self.transcriber = None
 		self.error_type = None
 		self.del_edge = False
 		self.types = list()
-		self.ptb = Trans()
-		self.ms = Trans()
+		self.ptb = Trans(models)
+		self.ms = Trans(models)
 
 	def _summarize_type(self):
 		t = set(self.types)
@@ -127,18 +157,25 @@ class ErrSeq:
 		else:
 			self.error_type = Err.MIX.name
 
-	def summarize(self, top_n):
+	def summarize(self, top_n, sup=True):
 		self._summarize_type()
-		self.ptb.make_summary(top_n, other=self.ms)
-		self.ms.make_summary(top_n, other=self.ptb)
+		self.ptb.make_summary(top_n, other=self.ms, sup=sup)
+		self.ms.make_summary(top_n, other=self.ptb, sup=sup)
 
 	def add_type(self, value):
 		self.types.append(value)
 
-	# does not include list or ptb and ms Trans objects
+	# does not include ptb and ms Trans objects
 	def get_header(self):
-		return list(self.__dict__.keys())[:5]
+		return list(self.FIELDS)
 
-	# does not include list or ptb and ms Trans objects
+	# does not include ptb and ms Trans objects
 	def get_values(self):
-		return list(self.__dict__.values())[:5]
+		return [getattr(self, x) for x in self.FIELDS]
+
+	def get_row_header(self):
+		"""Header of a full output row, ptb then ms columns."""
+		return self.get_header() + self.ptb.get_header('ptb') + self.ms.get_header('ms')
+
+	def get_row(self):
+		return self.get_values() + self.ptb.get_values() + self.ms.get_values()
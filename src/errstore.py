@@ -0,0 +1,113 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Queries over the indexed error store, swbd_errors.db.
+
+main.py writes the store next to swbd_errors.tsv when sqlite is set in the
+config.  It holds the same rows, with indexes on index, transcriber,
+error_type, del_edge, top_n and ms_top_n, so a query only reads the matching
+sequences.  Columns hold the same text as the tsv; booleans are 0/1 and a
+missing top_n is null.
+
+python src/errstore.py project_dir/swbd_errors.db -f sw4103 -t DEL -r X
+"""
+
+
+import argparse
+import sqlite3
+import sys
+import pandas as pd
+
+
+class ErrorStore:
+
+	def __init__(self, path):
+		self.conn = sqlite3.connect('file:{}?mode=ro'.format(path), uri=True)
+		self.columns = [x[1] for x in self.conn.execute('PRAGMA table_info(errors)') if x[1] != 'seq']
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def close(self):
+		self.conn.close()
+
+	@staticmethod
+	def where(index=None, file=None, transcriber=None, error_type=None, del_edge=None, top_n=None, ms_top_n=None):
+		"""WHERE clause and parameters of the filters given, all of which must hold.
+
+		file matches every utterance of a conversation ('sw4103.trans', 'sw4103'
+		or '4103').  error_type may be a list of types.  top_n and ms_top_n are a
+		word, or True for any top word."""
+		terms, params = list(), list()
+		if index is not None:
+			terms.append('"index" = ?')
+			params.append(index)
+		if file is not None:
+			# the index starts with the file number, so a file is a range of it
+			file_num = str(file).replace('.trans', '').replace('sw', '')
+			terms.append('"index" >= ? AND "index" < ?')
+			params += [file_num + '_', file_num + chr(ord('_') + 1)]
+		if transcriber is not None:
+			terms.append('transcriber = ?')
+			params.append(transcriber)
+		if error_type is not None:
+			types = [error_type] if isinstance(error_type, str) else list(error_type)
+			terms.append('error_type IN ({})'.format(', '.join('?' * len(types))))
+			params += types
+		if del_edge is not None:
+			terms.append('del_edge = ?')
+			params.append(int(del_edge))
+		for col, word in (('top_n', top_n), ('ms_top_n', ms_top_n)):
+			if word is True:
+				terms.append('{} IS NOT NULL'.format(col))
+			elif word is not None:
+				terms.append('{} = ?'.format(col))
+				params.append(word)
+		return ' WHERE ' + ' AND '.join(terms) if terms else '', params
+
+	def query(self, columns=None, limit=None, **filters):
+		"""Matching sequences as a dataframe, in the order they were written."""
+		columns = columns or self.columns
+		where, params = self.where(**filters)
+		sql = 'SELECT {} FROM errors{} ORDER BY seq'.format(', '.join('"{}"'.format(x) for x in columns), where)
+		if limit is not None:
+			sql += ' LIMIT {:d}'.format(limit)
+		return pd.read_sql_query(sql, self.conn, params=params)
+
+	def count(self, **filters):
+		where, params = self.where(**filters)
+		return self.conn.execute('SELECT COUNT(*) FROM errors' + where, params).fetchone()[0]
+
+	def plan(self, **filters):
+		"""SQLite's query plan for the filters, to check which index they use."""
+		where, params = self.where(**filters)
+		return [x[-1] for x in self.conn.execute('EXPLAIN QUERY PLAN SELECT * FROM errors' + where, params)]
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("store", help="swbd_errors.db written by main.py")
+	parser.add_argument("-i", "--index", help="one utterance, e.g. 4103_12_0")
+	parser.add_argument("-f", "--file", help="conversation, e.g. sw4103")
+	parser.add_argument("-r", "--transcriber")
+	parser.add_argument("-t", "--type", nargs='+', help="error types, e.g. DEL INS")
+	parser.add_argument("--del-edge", choices=['true', 'false'])
+	parser.add_argument("--top-n", help="ptb top word, or 'any'")
+	parser.add_argument("--ms-top-n", help="ms top word, or 'any'")
+	parser.add_argument("-c", "--columns", nargs='+', help="columns to print (default all)")
+	parser.add_argument("-n", "--limit", type=int)
+	parser.add_argument("--count", action='store_true', help="only print the number of matches")
+	args = parser.parse_args()
+
+	filters = {'index': args.index, 'file': args.file, 'transcriber': args.transcriber, 'error_type': args.type,
+			   'del_edge': None if args.del_edge is None else args.del_edge == 'true',
+			   'top_n': True if args.top_n == 'any' else args.top_n,
+			   'ms_top_n': True if args.ms_top_n == 'any' else args.ms_top_n}
+	with ErrorStore(args.store) as store:
+		if args.count:
+			print(store.count(**filters))
+		else:
+			store.query(args.columns, args.limit, **filters).to_csv(sys.stdout, sep='\t', index=False)
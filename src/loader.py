@@ -0,0 +1,83 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Concurrent loading of the input files of a build.
+
+Each file is read whole on a thread, so the reads overlap on slow (e.g.
+network-mounted) disks, then parsed on a process pool, so the evaluation of
+list columns runs on several cores.  submit returns a future per file and a
+caller waits only on those it needs next, so each merge starts as soon as
+its own files are parsed.  With one job the files are parsed on the reading
+threads instead.
+
+A file can also be indexed (e.g. by conversation) on its reading thread,
+while its contents are in memory, so the index needs no read of its own.
+
+The read, the index and the parse of each file are timed where they run
+and added to the profile by result(), on the main thread, as 'read <file>',
+'index <file>' and 'parse <file>' stages of the stage that waits for them.
+"""
+
+
+import io
+import multiprocessing
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import profiler
+
+
+def _parse(parse, raw, args):
+	"""parse over raw bytes, with its wall and cpu seconds."""
+	start, cpu = time.perf_counter(), time.thread_time()
+	result = parse(io.BytesIO(raw), *args)
+	return result, time.perf_counter() - start, time.thread_time() - cpu
+
+
+class Loader:
+
+	def __init__(self, jobs=1):
+		self.threads = ThreadPoolExecutor()
+		# the processes are started here, before any thread is
+		self.pool = multiprocessing.Pool(jobs) if jobs > 1 else None
+		self.indexes = dict()
+
+	def submit(self, path, parse, *args, index=None):
+		"""Future of parse(buffer, *args) over the contents of path, see result.
+		If given, index(buffer) is kept in indexes[path] once the result is in."""
+		return self.threads.submit(self._load, path, parse, args, index)
+
+	def _load(self, path, parse, args, index):
+		start, cpu = time.perf_counter(), time.thread_time()
+		with open(path, 'rb') as f:
+			raw = f.read()
+		read = (time.perf_counter() - start, time.thread_time() - cpu, len(raw))
+		indexed = None if index is None else _parse(index, raw, ())
+		if self.pool is None:
+			parsed = _parse(parse, raw, args)
+		else:
+			parsed = self.pool.apply(_parse, (parse, raw, args))
+		return path, read, indexed, parsed
+
+	def result(self, future):
+		"""Parsed contents of a submitted file, once they are in."""
+		path, (read_wall, read_cpu, size), indexed, (result, parse_wall, parse_cpu) = future.result()
+		name = os.path.basename(path)
+		profiler.add('read ' + name, read_wall, read_cpu, {'bytes': size})
+		if indexed is not None:
+			self.indexes[path], index_wall, index_cpu = indexed
+			profiler.add('index ' + name, index_wall, index_cpu)
+		profiler.add('parse ' + name, parse_wall, parse_cpu, {'rows': len(result)})
+		return result
+
+	def close(self):
+		self.threads.shutdown(cancel_futures=True)
+		if self.pool is not None:
+			self.pool.terminate()
+			self.pool.join()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
@@ -7,32 +7,24 @@ Pull errors from alignment with their surprisal LLR and various features.
 
 import argparse
 from collections import defaultdict
+import itertools
+import logging
+import multiprocessing
+import os
 import pickle
+import numpy as np
+import columnar
 import data
+import profiler
+import sink
+import store
+import surprisal
 import util
 from errinfo import ErrSeq, Lex
+from util import get_col
 
 
-def get_col(datatype, dtype):
-	if dtype == 'ptb':
-		data = 'ptb'
-	else:
-		data = 'ms'
-	d = {
-		('ptb', 'token'): 'sentence_dtok',
-		('ms', 'token'): 'ms_sentence_dtok',
-		('ptb', 'name'): 'names',
-		('ms', 'name'): 'ms_names',
-		('ptb', 'shape'): 'shapes',
-		('ms', 'shape'): 'ms_shapes',
-		('ptb', 'score'): 'scores-ngram',
-		('ms', 'score'): 'ms_scores-ngram',
-		('ptb', 'nn_score'): 'scores-gru',
-		('ms', 'nn_score'): 'ms_scores-gru',
-		('ptb', 'disf'): 'disfl',
-		('ms', 'disf'): 'ms_disfl'
-	}
-	return d[(data, datatype)]
+TOP_N_FILE = 'data/top-n.P'
 
 
 class ErrorFlags:
@@ -58,24 +50,164 @@ class GenerateError:
 	def __init__(self, args):
 		config = util.get_config(args.config)
 		self.logger = util.get_logger(config['debug'])
+		if args.profile or args.pstats or config.get('profile'):
+			profiler.enable(pstats=bool(args.pstats))
 
 		# load the switchboard file
 		alignment = data.load_data(config, self.logger)
 		self.logger.info('Processing errors...')
 
-		result = list()  # list of structured error objects
 		top_n = self.get_top_word()
+		engine = config.get('engine', 'loop')
+		models = util.get_models(config)[1:]
+		jobs = args.jobs or config.get('jobs', 1)
+
+		def extract(subset):
+			if jobs > 1:
+				return iter_parallel(subset, top_n, engine, jobs, self.logger, models)
+			return iter_errors(subset, top_n, engine, self.logger, models)
+
+		# with incremental only the conversations changed since the last results are extracted
+		fingerprints = data.corpus_fingerprints(config)
+		settings = data.results_settings(config, models, TOP_N_FILE)
+		changed = None
+		if args.incremental or config.get('incremental'):
+			changed = data.changed_conversations(config, settings, fingerprints)
+
+		# results are written in batches as they are found.  Until they are all
+		# in, no manifest says they are up to date, and a failed run puts the
+		# previous results back (see sink.ResultSink.abort)
+		data.clear_results_manifest(config)
+		with profiler.stage('extract'):
+			with data.open_results(config, self.logger, models, previous=changed is not None) as results:
+				if changed is None:
+					for item in extract(alignment):
+						results.add(item)
+				else:
+					update_results(results, alignment, changed, extract, self.logger)
+			profiler.count('utterances', len(alignment))
+			profiler.count('errors', results.count)
+		data.save_results_manifest(config, settings, fingerprints)
+		self.logger.info('Error sequences found: {}'.format(str(results.count)))
+
+		if profiler.enabled():
+			output = os.path.join(config['project_dir'], 'swbd_profile.json')
+			self.logger.info('Writing profile to {}'.format(output))
+			profiler.dump(output, args.pstats)
+			profiler.log_summary(self.logger)
 
+	def get_top_word(self):
+		try:
+			return pickle.load(open(TOP_N_FILE, 'rb'))
+		except FileNotFoundError:
+			self.logger.error('Top n file missing at: /data/top-n.P')
+			exit()
+
+
+def iter_errors(alignment, top_n, engine, logger, models=()):
+	"""Yields the ErrSeq found by the selected extraction engine, summarized
+	except for their surprisal (see surprisal.set_sup_diffs).
+	models are the nn models after the first, scored next to it."""
+	if engine == 'columnar':
+		return columnar.iter_errors(alignment, top_n, logger, models)
+	elif engine == 'loop':
+		if isinstance(alignment, store.Corpus):
+			alignment = alignment.to_frame()
+		return ErrorExtractor(logger, models).iter_errors(alignment, top_n)
+	raise ValueError('Unknown extraction engine: {}'.format(engine))
+
+
+def extract_errors(alignment, top_n, engine, logger, models=()):
+	"""Runs the selected extraction engine and returns the list of ErrSeq."""
+	result = list(iter_errors(alignment, top_n, engine, logger, models))
+	surprisal.set_sup_diffs(result)
+	return result
+
+
+def update_results(results, alignment, changed, extract, logger):
+	"""Copies the sequences of unchanged conversations from the previous
+	results and adds those extract finds in the changed ones, in alignment order."""
+	shards = store.group_rows(alignment['file'])
+	files = [(alignment['file'][x[0]], sink.file_num(alignment.index[x[0]])) for x in shards]
+	rows = [x for x, (name, _) in zip(shards, files) if name in changed]
+	logger.info('Conversations changed: {} of {}'.format(len(rows), len(shards)))
+	errors = extract(alignment.take(np.sort(np.concatenate(rows)))) if rows else iter(())
+
+	item = next(errors, None)
+	for name, file_num in files:
+		if name not in changed:
+			results.copy(file_num)
+		while item is not None and sink.file_num(item.index) == file_num:
+			results.add(item)
+			item = next(errors, None)
+
+
+_worker = dict()  # per process state of the extraction pool
+
+
+def _init_worker(alignment, top_n, engine, models):
+	_worker['alignment'] = alignment
+	_worker['top_n'] = top_n
+	_worker['engine'] = engine
+	_worker['models'] = models
+
+
+def _extract_shard(rows):
+	shard = _worker['alignment'].take(rows)
+	shard.index = rows  # row positions, so shards can be merged back in order
+	return list(iter_errors(shard, _worker['top_n'], _worker['engine'], logging.getLogger(), _worker['models']))
+
+
+def iter_parallel(alignment, top_n, engine, jobs, logger, models=()):
+	"""Shards the alignments by conversation file over a process pool and
+	yields the error sequences in alignment order, like iter_errors."""
+	shards = store.group_rows(alignment['file'])
+	logger.info('Extracting {} conversations on {} processes'.format(len(shards), jobs))
+
+	# when each file is one block of rows the shards come back in order already
+	contiguous = all(x[-1] - x[0] + 1 == len(x) for x in shards)
+	chunksize = max(1, len(shards) // (jobs * 4))
+	with multiprocessing.Pool(jobs, initializer=_init_worker, initargs=(alignment, top_n, engine, models)) as pool:
+		parts = pool.imap(_extract_shard, shards, chunksize=chunksize)
+		if contiguous:
+			items = itertools.chain.from_iterable(parts)
+		else:
+			# a stable sort keeps the order of sequences within the same utterance
+			items = sorted(itertools.chain.from_iterable(parts), key=lambda x: x.index)
+		for item in items:
+			item.index = alignment.index[item.index]
+			yield item
+
+
+class ErrorExtractor:
+	"""Walks each alignment token by token, keeping pointers into the ptb/ms columns."""
+
+	def __init__(self, logger, models=()):
+		self.logger = logger
+		self.models = tuple(models)  # nn models after the first
+		self.ix = defaultdict(int)
+		self.flags = ErrorFlags()
+
+	def extract(self, alignment, top_n):
+		result = list(self.iter_errors(alignment, top_n))  # list of structured error objects
+		surprisal.set_sup_diffs(result)
+		return result
+
+	def iter_errors(self, alignment, top_n):
 		# for each utterance
 		for i, row in alignment.iterrows():
 			self.ix = defaultdict(int)
 			self.flags = ErrorFlags()
-			current = ErrSeq()
+			current = ErrSeq(self.models)
+			# pointers precomputed by data.preprocess, if the corpus has them
+			tables = [(k, row['ix_' + k]) for k in columnar.POINTERS] if 'ix_ptb' in row else None
 
 			# for each token of the alignment
 			for j in range(len(row['comb_ann'])):
 				self.flags.reset()
 				self.ix['ann'] = j
+				if tables:
+					self.ix.update((k, table[j]) for k, table in tables)
 				label = row['comb_ann'][self.ix['ann']]
 
 				# check special conditions
@@ -104,12 +236,14 @@ class GenerateError:
 						current = self.process_error(i, row, label, current)
 						# on to new errors if not first part of split or not that one of them is last part of split
 						if not self.flags.ptb_split and not self.flags.ms_split and not self.flags.b_split:
-							current.summarize(top_n)
-							result.append(current)
+							current.summarize(top_n, sup=False)
+							yield current
 							self.flags.prev_error = False
-							current = ErrSeq()
+							current = ErrSeq(self.models)
 
 				# iterate through our pointers
+				if tables:
+					continue
 				if util.is_ptb(label):
 					self.ix['ptb'] += 1
 					if not self.flags.special_tok:
@@ -125,14 +259,13 @@ class GenerateError:
 
 			# add an EOS token after the error sequence in needed
 			if self.flags.prev_error:
+				if tables:
+					self.ix.update((k, table[-1]) for k, table in tables)
 				label = util.get_norm_label()
 				self.flags.eos = True
 				current = self.process_error(i, row, label, current)
-				current.summarize(top_n)
-				result.append(current)
-
-		self.logger.info('Error sequences found: {}'.format(str(len(result))))
-		data.write_tsv(config, self.logger, result)
+				current.summarize(top_n, sup=False)
+				yield current
 
 	def process_helper(self, i, row, temp, dtype):
 		eos_token = '<EOS>'
@@ -160,15 +293,14 @@ class GenerateError:
 				shape = ''
 		temp.set_token(token, shape)
 
+		score_cols = util.get_score_cols(dtype, self.models)
 		try:
-			score = row[get_col('score', dtype)][self.ix[dtype + '_dtok']]
-			nn_score = row[get_col('nn_score', dtype)][self.ix[dtype + '_dtok']]
+			scores = [row[col][self.ix[dtype + '_dtok']] for col in score_cols]
 			temp.set_disf(disf)
 		except IndexError as e:
 			self.debug_report(e, row, i, dtype)
-			score = 0.01
-			nn_score = 0.01
-		temp.set_score(score, nn_score)
+			scores = [0.01] * len(score_cols)
+		temp.set_score(scores)
 
 		return temp
 
@@ -195,14 +327,6 @@ class GenerateError:
 					current.del_edge = True
 		return current
 
-	def get_top_word(self):
-		f = 'data/top-n.P'
-		try:
-			return pickle.load(open(f, 'rb'))
-		except FileNotFoundError:
-			self.logger.error('Top n file missing at: /data/top-n.P')
-			exit()
-
 	def debug_report(self, e, row, i, dtype):
 		"""in case of indexing error, includes some useful info"""
 		self.logger.debug('INDEX ERROR {}'.format(e))
@@ -225,5 +349,12 @@ class GenerateError:
 if __name__ == "__main__":
 	parser = argparse.ArgumentParser()
 	parser.add_argument("config", help="experiment config file")
+	parser.add_argument("-j", "--jobs", type=int,
+						help="number of processes to extract errors with, overrides the config")
+	parser.add_argument("--profile", action='store_true',
+						help="time each stage and write swbd_profile.json to the project dir")
+	parser.add_argument("--pstats", metavar="FILE", help="also write cProfile stats of the run to FILE")
+	parser.add_argument("-i", "--incremental", action='store_true',
+						help="only extract the conversations that changed since the last results")
 	args = parser.parse_args()
 	GenerateError(args)
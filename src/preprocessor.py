@@ -13,12 +13,31 @@ cont        Match stylistic differences in ptb and ms.  It updates the ptb token
             differences between WANT TO and GOING TO.
 detokenize  'you_know' and CONTRACTIONS are joined.  WANT TO and GOING to are never
             joined.
+
+By default each pass runs over the whole corpus at once: every list column is
+flattened into one array of tokens with per-utterance offsets (columnar.Ragged)
+and the pointers of the row-wise passes become cumulative sums.  The few
+utterances the array passes cannot take, e.g. ones whose lists disagree in
+length, go through the row-wise functions below so the output stays the same.
+
+With --incremental only the conversations whose input rows changed since the
+last run are transformed, the others are copied from the previous output.
+The fingerprint of each conversation's rows is kept in <output>.files.json.
 """
 
 import argparse
-from collections import defaultdict
-from data import read_tsv
+from collections import defaultdict, deque
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import numpy as np
+from columnar import Ragged
+from data import read_tsv, iter_tsv, list_columns, parse_columns, conversation_lines, fingerprint, group_lines, \
+    ALIGNMENT_SCHEMA
 import util
+import vocab
 
 
 def update_ids(sent, tok_ids):
@@ -144,28 +163,594 @@ def detokenize(row, sent_col, tok_ids_col):
     return row[sent_col]
 
 
-def preprocess(args):
-    df = read_tsv(args.file)
+PTB_LABELS = util.ON_PTB
+MS_LABELS = util.ON_MS
+FILES_SUFFIX = '.files.json'
+TOKEN_PAIRS = [('sentence', 'names'), ('ms_sentence', 'ms_names')]
+CONT_COLS = ['sentence', 'names', 'disfl', 'ms_sentence', 'ms_names', 'comb_sentence', 'comb_ann']
+
+
+def to_ragged(lists):
+    col = Ragged.from_lists(lists)
+    col.values = col.values.astype(str)
+    return col
+
+
+def token_rows(col):
+    """Utterance and position within it of every token of a Ragged column."""
+    lengths = col.lengths()
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    return rows, np.arange(len(rows)) - col.offsets[rows]
+
+
+def count_before(mask, rows, offsets):
+    """Number of True values of mask before each token, within its utterance."""
+    total = np.zeros(len(mask) + 1, dtype=np.int64)
+    np.cumsum(mask, out=total[1:])
+    return total[:-1] - total[offsets[rows]]
+
+
+def select(values, rows, keep, n_rows):
+    """Ragged column of the kept values."""
+    offsets = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows[keep], minlength=n_rows), out=offsets[1:])
+    return Ragged(values[keep], offsets)
+
+
+def widen(values, extra):
+    """Copy of a string array with room for extra more characters per value."""
+    return values.astype('<U{}'.format(values.dtype.itemsize // 4 + extra))
+
+
+def every_other(at, linked):
+    """Of runs of overlapping matches at the given positions (linked to the
+    one before), keeps the first, third... like the row-wise loops do by
+    skipping past each match."""
+    k = np.arange(len(at))
+    start = np.maximum.accumulate(np.where(linked, 0, k))
+    return at[(k - start) % 2 == 0]
+
+
+def bad_rows(mask, rows, n_rows):
+    return np.bincount(rows[mask], minlength=n_rows) > 0
+
+
+def interleave(parts, n_rows):
+    """One Ragged out of (rows, Ragged) parts that together cover every utterance."""
+    lengths = np.zeros(n_rows, dtype=np.int64)
+    for rows, col in parts:
+        lengths[rows] = col.lengths()
+    keys = np.concatenate([np.repeat(rows, col.lengths()) for rows, col in parts])
+    values = np.concatenate([col.values for _, col in parts])
+    offsets = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return Ragged(values[np.argsort(keys, kind='stable')], offsets)
+
+
+def apply_columns(cols, array_pass, row_pass, out, rows=None):
+    """Runs array_pass on the utterances in rows (all by default) and returns
+    the out columns.  The utterances array_pass marks as bad are redone with
+    row_pass, which takes and returns a dict row like the df.apply passes."""
+    n_rows = len(next(iter(cols.values())))
+    every = rows is None
+    if every:
+        rows = np.arange(n_rows)
+        part = cols
+    else:
+        part = {k: x.take(rows) for k, x in cols.items()}
+    result, bad = array_pass(part)
+    if every and not bad.any():
+        return result
+
+    done = np.flatnonzero(~bad)
+    redo = dict((k, list()) for k in out)
+    for i in rows[bad].tolist():
+        row = row_pass(dict((k, x.row(i).tolist()) for k, x in cols.items()))
+        for k in out:
+            redo[k].append(row[k])
+
+    rest = np.setdiff1d(np.arange(n_rows), rows)
+    updated = dict()
+    for k in out:
+        parts = [(rows[done], result[k].take(done)), (rows[bad], to_ragged(redo[k]))]
+        if len(rest):
+            parts.append((rest, cols[k].take(rest)))
+        updated[k] = interleave(parts, n_rows)
+    return updated
+
+
+def names_columns(cols, sent_col, tok_ids_col):
+    """update_names over the whole corpus."""
+    sent, tok_ids = cols[sent_col], cols[tok_ids_col]
+    rows, pos = token_rows(sent)
+    bad = sent.lengths() != tok_ids.lengths()
+    ids = tok_ids.gather(rows, pos, '')[0]
+    words = sent.values
+    after = np.append(words[1:], '')
+    has_next = pos < sent.lengths()[rows] - 1
+
+    dash = has_next & (words == '---')
+    you_know = np.flatnonzero(has_next & (words == 'you') & (after == 'know'))
+    reduced = np.flatnonzero(has_next & ((words == 'want') | (words == 'going')) & (after == 'to'))
+    reduced = reduced[np.char.endswith(ids[reduced], '_a') & np.char.endswith(ids[reduced + 1], '_b')]
+
+    values = widen(ids, 2)
+    values[dash] = 'None'
+    values[you_know] = np.char.add(ids[you_know], '_a')
+    values[you_know + 1] = np.char.add(ids[you_know + 1], '_b')
+    values[reduced] = np.char.add(ids[reduced], '0')
+    values[reduced + 1] = np.char.add(ids[reduced + 1], '0')
+    return {tok_ids_col: Ragged(values, sent.offsets)}, bad
+
+
+def cont_columns(cols):
+    """update_cont over utterances that all have a CONT_MS."""
+    ann = cols['comb_ann']
+    labels = ann.values
+    coded = ann.encode()
+    codes = coded.vocab.recode(vocab.LABELS)[coded.values]
+    rows, pos = token_rows(ann)
+    n_rows = len(ann)
+    is_ptb = vocab.ON_PTB[codes]
+    ptb_ix = count_before(is_ptb, rows, ann.offsets)
+    ms_ix = count_before(vocab.ON_MS[codes], rows, ann.offsets)
+
+    name, name_ok = cols['names'].gather(rows, ptb_ix, '')
+    named = name_ok & (name != 'None')
+    disfl_ix = count_before(is_ptb & named, rows, ann.offsets)
+
+    ptb = is_ptb & (codes != vocab.LABELS.codes['CONT_TREE'])
+    cont = codes == vocab.LABELS.codes['CONT_MS']
+    word, word_ok = cols['sentence'].gather(rows, ptb_ix, '')
+    ms_word, ms_word_ok = cols['ms_sentence'].gather(rows, ms_ix, '')
+    ms_name, ms_name_ok = cols['ms_names'].gather(rows, ms_ix, '')
+    # a ptb token past the last disfluency takes the one before it
+    past = ptb & (disfl_ix >= cols['disfl'].lengths()[rows])
+    disfl, disfl_ok = cols['disfl'].gather(rows, disfl_ix - past, '')
+    has_disfl = ptb & named | cont
+    comb, comb_ok = cols['comb_sentence'].gather(rows, pos, '')
+    has_comb = ~coded.vocab.table(lambda x: x.startswith('CONT'))[coded.values] | cont
+
+    missing = ptb & ~(word_ok & name_ok) | cont & ~(ms_word_ok & ms_name_ok) | \
+        has_disfl & ~disfl_ok | has_comb & ~comb_ok
+    result = {
+        'sentence': select(np.where(ptb, word, ms_word), rows, ptb | cont, n_rows),
+        'names': select(np.where(ptb, name, ms_name), rows, ptb | cont, n_rows),
+        'disfl': select(disfl, rows, has_disfl, n_rows),
+        'comb_sentence': select(comb, rows, has_comb, n_rows),
+        'comb_ann': select(np.where(cont, 'CONT', labels), rows, has_comb, n_rows)
+    }
+    return result, bad_rows(missing, rows, n_rows)
+
+
+def reductions_columns(cols):
+    """update_reductions over the whole corpus."""
+    PATTERN1 = ['going', 'to', 'going', 'to']
+    PATTERN2 = ['want', 'to', 'want', 'to']
+    TARGET = ['SUB_MS', 'SUB_MS', 'SUB_TREE', 'INS']
+    ann = cols['comb_ann']
+    rows, pos = token_rows(ann)
+    n_rows = len(ann)
+    bad = ann.lengths() != cols['comb_sentence'].lengths()
+    comb = cols['comb_sentence'].gather(rows, pos, '')[0]
+    length = ann.lengths()[rows]
+
+    at = np.flatnonzero(((comb == 'going') | (comb == 'want')) & (pos + 4 <= length))
+    window = at[:, None] + np.arange(4)
+    words = comb[window]
+    matched = (words == PATTERN2).all(axis=1) | (words == PATTERN1).all(axis=1) & \
+        (ann.values[window] == TARGET).all(axis=1) & (pos[at] + 4 < length[at])
+    at = at[matched]
+    # a match can only overlap the one two tokens before it
+    at = every_other(at, np.append(False, np.diff(at) == 2))
+
+    keep = np.ones(len(rows), dtype=bool)
+    keep[at + 2] = False
+    keep[at + 3] = False
+    labels = widen(ann.values, 4)
+    labels[at] = 'CONT'
+    labels[at + 1] = 'CONT'
+    return {'comb_ann': select(labels, rows, keep, n_rows),
+            'comb_sentence': select(comb, rows, keep, n_rows)}, bad
+
+
+def detokenize_columns(cols, sent_col, tok_ids_col):
+    """detokenize over the whole corpus."""
+    sent, tok_ids = cols[sent_col], cols[tok_ids_col]
+    rows, pos = token_rows(tok_ids)
+    n_rows = len(tok_ids)
+    words = sent.gather(rows, pos, '')[0]
+    ids = tok_ids.values
+    length = tok_ids.lengths()[rows]
+
+    # a first half joins the token after it, which is then skipped
+    split = np.flatnonzero(np.char.endswith(ids, '_a'))
+    joined = every_other(split, np.append(False, np.diff(split) == 1) & (pos[split] > 0))
+    last = joined[pos[joined] == length[joined] - 1]
+    bad = (sent.lengths() != tok_ids.lengths()) | bad_rows(last, rows, n_rows)
+    joined = joined[pos[joined] < length[joined] - 1]
+
+    keep = ids != 'None'
+    keep[joined + 1] = False
+    keep[joined] = True
+    values = widen(words, words.dtype.itemsize // 4 + 1)
+    first, second = words[joined], words[joined + 1]
+    glue = np.where((first == 'you') & (second == 'know'), '_', '')
+    values[joined] = np.char.add(np.char.add(first, glue), second)
+    return {sent_col + '_dtok': select(values, rows, keep, n_rows)}, bad
+
+
+def preprocess_columns(df, args, log=print):
+    """The passes of preprocess, run over the flattened corpus."""
+    names = [col for pair in TOKEN_PAIRS for col in pair]
+    if args.cont:
+        names = CONT_COLS
+    cols = dict((k, to_ragged(df[k].tolist())) for k in names)
+
+    log('Updating IDs')
+    for sent_col, tok_ids_col in TOKEN_PAIRS:
+        def row_pass(row):
+            row[tok_ids_col] = update_names(row, sent_col, tok_ids_col)
+            return row
+        cols.update(apply_columns(cols, lambda x: names_columns(x, sent_col, tok_ids_col),
+                                  row_pass, [tok_ids_col]))
+
+    if args.cont:
+        log('Updating style differences')
+        rows = np.unique(token_rows(cols['comb_ann'])[0][cols['comb_ann'].values == 'CONT_MS'])
+        out = ['disfl', 'sentence', 'names', 'comb_ann', 'comb_sentence']
+        cols.update(apply_columns(cols, cont_columns, update_cont, out, rows))
+        cols.update(apply_columns(cols, reductions_columns, update_reductions, ['comb_ann', 'comb_sentence']))
+
+    for k in names:
+        df[k] = cols[k].to_lists()
+
+    if args.detokenize:
+        log('Detokenizing values')
+        for sent_col, tok_ids_col in TOKEN_PAIRS:
+            def row_pass(row):
+                row[sent_col + '_dtok'] = detokenize(row, sent_col, tok_ids_col)
+                return row
+            dtok = apply_columns(cols, lambda x: detokenize_columns(x, sent_col, tok_ids_col),
+                                 row_pass, [sent_col + '_dtok'])
+            df[sent_col + '_dtok'] = dtok[sent_col + '_dtok'].to_lists()
+    return df
+
+
+def new_id(sent, tok_ids, i):
+    """The id update_ids gives token i, from the tokens next to it."""
+    def suffixes(j):
+        if j < 0 or j + 1 >= len(sent):
+            return None
+        current = (sent[j], sent[j + 1])
+        if current == ('you', 'know'):
+            return '_a', '_b'
+        if current in [('want', 'to'), ('going', 'to')] and \
+                tok_ids[j].endswith('_a') and tok_ids[j + 1].endswith('_b'):
+            return '0', '0'
+        return None
+
+    before = suffixes(i - 1)
+    if before:
+        return tok_ids[i] + before[1]
+    if sent[i] == '---' and i + 1 < len(sent):
+        return 'None'
+    here = suffixes(i)
+    if here:
+        return tok_ids[i] + here[0]
+    return tok_ids[i]
 
-    print('Updating IDs')
-    token_pairs = [('sentence', 'names'), ('ms_sentence', 'ms_names')]
-    for sent_col, tok_ids_col in token_pairs:
+
+class Detokenizer:
+    """detokenize fed one (word, id) pair at a time."""
+
+    def __init__(self):
+        self.words = list()
+        self.first = None  # word waiting for the second half of its split
+
+    def add(self, word, tok_id):
+        if self.first is not None:
+            glue = '_' if self.first == 'you' and word == 'know' else ''
+            self.words.append(self.first + glue + word)
+            self.first = None
+        elif tok_id.endswith('_a'):
+            self.first = word
+        elif tok_id != 'None':
+            self.words.append(word)
+
+    def close(self):
+        if self.first is not None:
+            raise IndexError('list index out of range')
+        return self.words
+
+
+class Reducer:
+    """update_reductions fed one (comb, ann) pair at a time.  A match is only
+    decided once the token after it is seen, as pattern1 needs one."""
+    PATTERN1 = ['going', 'to', 'going', 'to']
+    PATTERN2 = ['want', 'to', 'want', 'to']
+    TARGET = ['SUB_MS', 'SUB_MS', 'SUB_TREE', 'INS']
+
+    def __init__(self):
+        self.comb = list()
+        self.ann = list()
+        self.buffer = list()
+
+    def add(self, word, label):
+        self.buffer.append((word, label))
+        if len(self.buffer) > 4:
+            self.step()
+
+    def step(self):
+        words = [x[0] for x in self.buffer[:4]]
+        if len(self.buffer) > 4 and [x[1] for x in self.buffer[:4]] == self.TARGET and \
+                words == self.PATTERN1 or words == self.PATTERN2:
+            self.comb.extend(words[:2])
+            self.ann.extend(['CONT', 'CONT'])
+            del self.buffer[:4]
+        else:
+            self.comb.append(words[0])
+            self.ann.append(self.buffer[0][1])
+            del self.buffer[0]
+
+    def close(self):
+        while self.buffer:
+            self.step()
+        return self.comb, self.ann
+
+
+def fuse_tokens(sent, tok_ids, detok):
+    """update_names and detokenize in one scan over the tokens."""
+    names = list()
+    detokenizer = Detokenizer()
+    for i, word in enumerate(sent):
+        names.append(new_id(sent, tok_ids, i))
+        if detok:
+            detokenizer.add(word, names[-1])
+    return names, detokenizer.close() if detok else None
+
+
+def fuse_cont(row, ms_names, detok):
+    """update_names, update_cont, update_reductions and detokenize of the ptb
+    side in one scan over the alignment."""
+    sent, tok_ids, disfl = row['sentence'], row['names'], row['disfl']
+    out = defaultdict(list)
+    reducer = Reducer()
+    detokenizer = Detokenizer()
+    ptb, ms, ptb_disfl = 0, 0, 0
+    for i, label in enumerate(row['comb_ann']):
+        if label in PTB_LABELS:
+            name = new_id(sent, tok_ids, ptb) if ptb < len(sent) else None
+            if label != 'CONT_TREE':
+                if name is None:
+                    raise IndexError('list index out of range')
+                out['sent'].append(sent[ptb])
+                out['names'].append(name)
+                detokenizer.add(sent[ptb], name)
+                if name != 'None':
+                    try:
+                        out['disfl'].append(disfl[ptb_disfl])
+                    except IndexError:  # this catches one edge case where 'None' is at EOS
+                        out['disfl'].append(disfl[ptb_disfl - 1])
+            if name is not None and name != 'None':
+                ptb_disfl += 1
+            ptb += 1
+        if label == 'CONT_MS':
+            out['sent'].append(row['ms_sentence'][ms])
+            out['names'].append(ms_names[ms])
+            detokenizer.add(row['ms_sentence'][ms], ms_names[ms])
+            out['disfl'].append(disfl[ptb_disfl])
+            reducer.add(row['comb_sentence'][i], 'CONT')
+        elif not label.startswith('CONT'):
+            reducer.add(row['comb_sentence'][i], label)
+        if label in MS_LABELS:
+            ms += 1
+
+    comb, ann = reducer.close()
+    return {'sentence': out['sent'], 'names': out['names'], 'disfl': out['disfl'],
+            'comb_sentence': comb, 'comb_ann': ann,
+            'sentence_dtok': detokenizer.close() if detok else None}
+
+
+def fuse_row(row, cont, detok):
+    """Every enabled pass over one utterance: one scan over the ms tokens, and
+    one over the ptb tokens, or over the alignment when it has a CONT_MS.
+    Only takes utterances whose lists line up, see fused_passes."""
+    out = dict()
+    out['ms_names'], out['ms_sentence_dtok'] = fuse_tokens(row['ms_sentence'], row['ms_names'], detok)
+    if cont and 'CONT_MS' in row['comb_ann']:
+        out.update(fuse_cont(row, out['ms_names'], detok))
+    else:
+        out['names'], out['sentence_dtok'] = fuse_tokens(row['sentence'], row['names'], detok)
+        if cont:
+            reducer = Reducer()
+            for word, label in zip(row['comb_sentence'], row['comb_ann']):
+                reducer.add(word, label)
+            out['comb_sentence'], out['comb_ann'] = reducer.close()
+    return out
+
+
+def separate_passes(row, cont, detok):
+    """The row-wise passes one after the other, as preprocess runs them."""
+    for sent_col, tok_ids_col in TOKEN_PAIRS:
+        row[tok_ids_col] = update_names(row, sent_col, tok_ids_col)
+    if cont:
+        row = update_reductions(update_cont(row))
+    if detok:
+        for sent_col, tok_ids_col in TOKEN_PAIRS:
+            row[sent_col + '_dtok'] = detokenize(row, sent_col, tok_ids_col)
+    return row
+
+
+def fused_passes(row, cont, detok):
+    aligned = len(row['sentence']) == len(row['names']) and \
+        len(row['ms_sentence']) == len(row['ms_names']) and \
+        (not cont or len(row['comb_sentence']) == len(row['comb_ann']))
+    if aligned:
+        try:
+            return fuse_row(row, cont, detok)
+        except IndexError:
+            pass  # the separate passes raise it again if it is real
+    return separate_passes(row, cont, detok)
+
+
+def preprocess_fused(df, args, log=print):
+    """The passes of preprocess fused into one scan per utterance, writing
+    every output column at the end."""
+    names = [col for pair in TOKEN_PAIRS for col in pair]
+    if args.cont:
+        names = CONT_COLS
+    out = names
+    if args.detokenize:
+        out = out + [sent_col + '_dtok' for sent_col, _ in TOKEN_PAIRS]
+
+    log('Updating IDs' + (', style differences' if args.cont else '') +
+          (', detokenizing values' if args.detokenize else ''))
+    results = dict((k, list()) for k in out)
+    for values in zip(*[df[k].tolist() for k in names]):
+        row = fused_passes(dict(zip(names, values)), args.cont, args.detokenize)
+        for k in out:
+            results[k].append(row[k] if k in row else values[names.index(k)])
+    for k in out:
+        df[k] = results[k]
+    return df
+
+
+def transform(df, args, log=print):
+    """Runs the passes enabled in args on a dataframe with the selected engine."""
+    if args.engine == 'fused':
+        return preprocess_fused(df, args, log)
+    if args.engine == 'columnar':
+        return preprocess_columns(df, args, log)
+
+    log('Updating IDs')
+    for sent_col, tok_ids_col in TOKEN_PAIRS:
         df[tok_ids_col] = df.apply(lambda x: update_names(x, sent_col, tok_ids_col),
                                    axis=1)
 
     if args.cont:
-        print('Updating style differences')
+        log('Updating style differences')
         df = df.apply(lambda x: update_cont(x), axis=1)
         df = df.apply(lambda x: update_reductions(x), axis=1)
 
     if args.detokenize:
-        print('Detokenizing values')
-        for sent_col, tok_ids_col in token_pairs:
+        log('Detokenizing values')
+        for sent_col, tok_ids_col in TOKEN_PAIRS:
             df[sent_col + '_dtok'] = df.apply(lambda x: detokenize(x, sent_col, tok_ids_col), axis=1)
+    return df
+
+
+_worker = dict()  # per process state of the streaming pool
+
+
+def init_worker(args, evaluated):
+    _worker['args'] = args
+    _worker['evaluated'] = evaluated
+
+
+def process_chunk(item):
+    """Parses and transforms one chunk of rows, returning it as tsv text."""
+    i, df = item
+    df = parse_columns(df, ALIGNMENT_SCHEMA, _worker['evaluated'])
+    df = transform(df, _worker['args'], log=lambda x: None)
+    return df.to_csv(sep='\t', index=None, header=i == 0)
 
+
+def stream(args):
+    """Reads, transforms and writes the alignments chunksize rows at a time,
+    on args.jobs processes.  At most two chunks per process are in flight so
+    memory does not grow with the file."""
+    chunks = iter_tsv(args.file, args.chunksize, schema=ALIGNMENT_SCHEMA)
+    first = next(chunks, None)
+    if first is None:
+        return
+    # lists outside the schema are found on the first rows, like read_tsv does
+    evaluated = list_columns(first, ALIGNMENT_SCHEMA)
+    chunks = enumerate(itertools.chain([first], chunks))
+
+    rows = 0
+    with open(args.output, 'w', newline='') as f:
+        if args.jobs > 1:
+            with multiprocessing.Pool(args.jobs, initializer=init_worker, initargs=(args, evaluated)) as pool:
+                pending = deque()
+                for item in chunks:
+                    rows += len(item[1])
+                    pending.append(pool.apply_async(process_chunk, (item,)))
+                    if len(pending) >= 2 * args.jobs:
+                        f.write(pending.popleft().get())
+                while pending:
+                    f.write(pending.popleft().get())
+        else:
+            init_worker(args, evaluated)
+            for item in chunks:
+                rows += len(item[1])
+                f.write(process_chunk(item))
+    print('Processed {} rows'.format(rows))
+
+
+def preprocess(args):
+    # fingerprints of another run would not match this output
+    if os.path.exists(args.output + FILES_SUFFIX):
+        os.remove(args.output + FILES_SUFFIX)
+    if args.stream:
+        stream(args)
+        return
+    df = read_tsv(args.file, schema=ALIGNMENT_SCHEMA)
+    df = transform(df, args)
     df.to_csv(args.output, sep='\t', index=None)
 
 
+def previous_run(args, settings):
+    """Output rows of the last run grouped by conversation and the
+    fingerprints of its input, if it used the same settings."""
+    files_file = args.output + FILES_SUFFIX
+    if not os.path.exists(files_file) or not os.path.exists(args.output):
+        return None, None, None
+    with open(files_file, 'r') as f:
+        last = json.load(f)
+    if last['settings'] != settings:
+        return None, None, None
+    header, groups = conversation_lines(args.output)
+    return header, groups, last['files']
+
+
+def incremental(args):
+    """Transforms only the conversations whose input rows changed since the
+    last run, splicing them between the previous output of the others."""
+    settings = {'cont': args.cont, 'detokenize': args.detokenize}
+    header, groups = conversation_lines(args.file)
+    if groups is None:
+        print('Conversations are not contiguous, processing every row')
+        preprocess(args)
+        return
+    files = {f: fingerprint(lines) for f, lines in groups.items()}
+    old_header, old, last = previous_run(args, settings)
+
+    if old is None:
+        preprocess(args)
+    else:
+        changed = [f for f in groups if f not in old or last.get(f) != files[f]]
+        print('Conversations changed: {} of {}'.format(len(changed), len(groups)))
+        new = dict()
+        if changed:
+            df = read_tsv(io.StringIO(header + ''.join(line for f in changed for line in groups[f])),
+                          schema=ALIGNMENT_SCHEMA)
+            new_header, new = group_lines(io.StringIO(transform(df, args).to_csv(sep='\t', index=None)))
+            if new_header != old_header:
+                print('Output columns changed, processing every row')
+                new = None
+        if new is None:
+            preprocess(args)
+        else:
+            with open(args.output, 'w', newline='') as f:
+                f.write(old_header)
+                for name in groups:
+                    f.writelines(new.get(name, []) if name in changed else old[name])
+
+    with open(args.output + FILES_SUFFIX, 'w') as f:
+        json.dump({'settings': settings, 'files': files}, f, indent=1)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("file", help="original alignments file")
@@ -176,5 +761,20 @@ if __name__ == "__main__":
     parser.add_argument("-d", "--detokenize",
                         help="Combine forms such as contractions and remove special chars.",
                         action='store_true')
+    parser.add_argument("-e", "--engine", choices=['columnar', 'fused', 'loop'], default='columnar',
+                        help="run each pass over the flattened corpus (default), all passes in one "
+                             "scan per utterance, or each pass row by row")
+    parser.add_argument("-s", "--stream", action='store_true',
+                        help="read and write the file in chunks of rows, for files too large for memory")
+    parser.add_argument("--chunksize", type=int, default=10000,
+                        help="rows per chunk when streaming")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of processes to transform the chunks on when streaming")
+    parser.add_argument("-i", "--incremental", action='store_true',
+                        help="only transform the conversations that changed since the last run "
+                             "to this output")
     args = parser.parse_args()
-    preprocess(args)
+    if args.incremental:
+        incremental(args)
+    else:
+        preprocess(args)
@@ -0,0 +1,134 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Per-stage instrumentation of the pipeline.
+
+A stage is timed with `with profiler.stage(name):`.  Stages nest, a stage
+started inside another is reported under its path, e.g.
+'load/preprocess/build base/verify'.  Each stage records:
+
+calls			times the stage was entered
+wall, cpu		seconds, cpu includes worker processes once they are joined
+peak_rss_mb		peak RSS of the process when the stage last ended
+rss_growth_mb	how much the stage raised that peak
+counts			anything added with profiler.count while it ran
+
+Nothing is recorded until enable() is called, so the stages cost next to
+nothing on a normal run.  enable() can also run cProfile over the whole
+run, its stats are written with the report.  Only the main thread records
+stages, work timed on other threads or processes is added with add().
+"""
+
+
+import cProfile
+import json
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+
+_stages = None
+_stack = list()
+_profile = None
+
+
+def enable(pstats=False):
+	global _stages, _profile
+	_stages = dict()
+	if pstats:
+		_profile = cProfile.Profile()
+		_profile.enable()
+
+
+def enabled():
+	return _stages is not None
+
+
+def _recording():
+	return _stages is not None and threading.current_thread() is threading.main_thread()
+
+
+def _cpu_time():
+	children = resource.getrusage(resource.RUSAGE_CHILDREN)
+	return time.process_time() + children.ru_utime + children.ru_stime
+
+
+def _peak_rss_mb():
+	# ru_maxrss is in kilobytes on linux
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _record():
+	"""Record of the stage at the top of the stack."""
+	path = '/'.join(_stack)
+	# records are kept in the order stages start, so parents come first
+	return _stages.setdefault(path, {'stage': path, 'depth': len(_stack) - 1, 'calls': 0, 'wall': 0.0, 'cpu': 0.0,
+									 'peak_rss_mb': 0.0, 'rss_growth_mb': 0.0, 'counts': dict()})
+
+
+@contextmanager
+def stage(name):
+	if not _recording():
+		yield
+		return
+
+	_stack.append(name)
+	record = _record()
+	record['calls'] += 1
+	rss = _peak_rss_mb()
+	start, cpu = time.perf_counter(), _cpu_time()
+	try:
+		yield
+	finally:
+		record['wall'] += time.perf_counter() - start
+		record['cpu'] += _cpu_time() - cpu
+		record['peak_rss_mb'] = _peak_rss_mb()
+		record['rss_growth_mb'] += record['peak_rss_mb'] - rss
+		_stack.pop()
+
+
+def add(name, wall, cpu=0.0, counts=None):
+	"""Records one call of stage name under the running stage, for work timed
+	off the main thread (see loader.Loader)."""
+	if not _recording():
+		return
+	_stack.append(name)
+	record = _record()
+	_stack.pop()
+	record['calls'] += 1
+	record['wall'] += wall
+	record['cpu'] += cpu
+	record['peak_rss_mb'] = _peak_rss_mb()
+	for key, n in (counts or dict()).items():
+		record['counts'][key] = record['counts'].get(key, 0) + n
+
+
+def count(key, n=1):
+	"""Adds n to a count of the innermost running stage."""
+	if not _recording() or not _stack:
+		return
+	counts = _stages['/'.join(_stack)]['counts']
+	counts[key] = counts.get(key, 0) + n
+
+
+def report():
+	return list(_stages.values()) if _stages is not None else list()
+
+
+def dump(path, pstats_file=None):
+	"""Writes the stage report as json, and the cProfile stats if enabled."""
+	with open(path, 'w') as f:
+		json.dump(report(), f, indent=1)
+	if _profile is not None and pstats_file:
+		_profile.disable()
+		_profile.dump_stats(pstats_file)
+
+
+def log_summary(logger):
+	logger.info('{:<44}{:>6}{:>10}{:>10}{:>10}  {}'.format('stage', 'calls', 'wall s', 'cpu s', 'peak MB', 'counts'))
+	for r in report():
+		name = '  ' * r['depth'] + r['stage'].split('/')[-1]
+		counts = ' '.join('{}={}'.format(k, v) for k, v in r['counts'].items())
+		logger.info('{:<44}{:>6}{:>10.2f}{:>10.2f}{:>10.0f}  {}'.format(name, r['calls'], r['wall'], r['cpu'],
+																	  r['peak_rss_mb'], counts))
@@ -0,0 +1,146 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Times each stage of the pipeline on a project made by make_corpus.py.
+
+Every stage runs in its own process so its peak RSS is its own:
+
+preprocessor	preprocessor.preprocess on raw_alignments.tsv
+build			data.preprocess with an empty cache (read, merge, save)
+merge			data.merge_models alone, on the alignments build_base reads
+load			data.load_data from the cache
+extract			main.GenerateError end to end, from the cache
+
+Reports wall and CPU seconds, utterances/s, error sequences/s and peak RSS,
+and optionally writes them as JSON to compare runs for regressions.
+"""
+
+import argparse
+import json
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+import yaml
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import data
+import main
+import preprocessor
+import util
+from make_corpus import make_corpus
+
+
+STAGES = ['preprocessor', 'build', 'merge', 'load', 'extract']
+
+
+def run_stage(stage, config_file, engine, jobs):
+	"""Runs one stage in this process and returns its measurements."""
+	config = util.get_config(config_file)
+	project_dir = config['project_dir']
+	logger = logging.getLogger()
+	logger.setLevel(logging.WARNING)
+	result = {'stage': stage, 'utterances': None, 'errors': None}
+
+	start, cpu = time.perf_counter(), time.process_time()
+	if stage == 'preprocessor':
+		output = os.path.join(project_dir, 'bench_preprocessed.tsv')
+		args = SimpleNamespace(file=os.path.join(project_dir, 'raw_alignments.tsv'), output=output,
+							   cont=True, detokenize=True, engine='columnar', stream=False)
+		preprocessor.preprocess(args)
+		result['utterances'] = sum(1 for _ in open(output)) - 1
+	elif stage == 'build':
+		shutil.rmtree(os.path.join(project_dir, 'cache'), ignore_errors=True)
+		result['utterances'] = len(data.preprocess(config, logger))
+	elif stage == 'merge':
+		align = data.build_base(config, logger)
+		start, cpu = time.perf_counter(), time.process_time()
+		result['utterances'] = len(data.merge_models(align, config, logger))
+	elif stage == 'load':
+		result['utterances'] = len(data.load_data(config, logger))
+	elif stage == 'extract':
+		result['utterances'] = len(data.load_data(config, logger))
+		# the engine is read from the config, so run from a copy that sets it
+		config['engine'] = engine
+		bench_config = os.path.join(project_dir, 'bench_config.yaml')
+		with open(bench_config, 'w') as f:
+			yaml.safe_dump(config, f)
+		start, cpu = time.perf_counter(), time.process_time()
+		main.GenerateError(SimpleNamespace(config=bench_config, jobs=jobs, profile=False, pstats=None,
+											 incremental=False))
+		with open(os.path.join(project_dir, 'swbd_errors.tsv')) as f:
+			result['errors'] = sum(1 for _ in f) - 1
+	result['wall'] = time.perf_counter() - start
+	result['cpu'] = time.process_time() - cpu
+
+	# worker processes count too, their ru_maxrss is in kilobytes on linux
+	result['peak_rss_mb'] = max(peak_rss_mb(), resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024)
+	return result
+
+
+def peak_rss_mb():
+	"""Peak RSS of this process since it started.  Its own ru_maxrss would
+	carry over the peak of the process that ran it (e.g. while generating
+	the corpus), VmHWM starts over on exec."""
+	with open('/proc/self/status') as f:
+		for line in f:
+			if line.startswith('VmHWM:'):
+				return int(line.split()[1]) / 1024
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(stage, config_file, engine, jobs):
+	"""Runs a stage in a fresh process, from the project directory (main.py
+	looks for data/top-n.P there)."""
+	cmd = [sys.executable, os.path.abspath(__file__), config_file, '--stage', stage,
+		   '--engine', engine, '--jobs', str(jobs)]
+	project_dir = util.get_config(config_file)['project_dir']
+	out = subprocess.run(cmd, cwd=project_dir, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+						 universal_newlines=True, check=True).stdout
+	return json.loads(out.strip().splitlines()[-1])
+
+
+def report(results):
+	print('{:<14}{:>10}{:>10}{:>14}{:>14}{:>12}'.format('stage', 'wall s', 'cpu s', 'utterances/s', 'errors/s',
+														  'peak MB'))
+	for r in results:
+		rate = lambda n: '{:.0f}'.format(n / r['wall']) if n else '-'
+		print('{:<14}{:>10.2f}{:>10.2f}{:>14}{:>14}{:>12.0f}'.format(r['stage'], r['wall'], r['cpu'],
+																	  rate(r['utterances']), rate(r['errors']),
+																	  r['peak_rss_mb']))
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("config", nargs='?', help="config of a project made by make_corpus.py")
+	parser.add_argument("-g", "--generate", metavar="DIR",
+						help="first generate a synthetic project in DIR and benchmark it")
+	parser.add_argument("-f", "--files", type=int, default=50, help="files to generate")
+	parser.add_argument("-t", "--turns", type=int, default=60, help="turns per generated file")
+	parser.add_argument("-s", "--stages", nargs='+', default=STAGES, choices=STAGES)
+	parser.add_argument("-e", "--engine", default='columnar', help="extraction engine for the extract stage")
+	parser.add_argument("-j", "--jobs", type=int, default=1, help="extraction processes")
+	parser.add_argument("-o", "--output", help="also write the results to this json file")
+	parser.add_argument("--stage", choices=STAGES, help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.stage:
+		print(json.dumps(run_stage(args.stage, args.config, args.engine, args.jobs)))
+		sys.exit()
+
+	config_file = args.config
+	if args.generate:
+		config_file = make_corpus(args.generate, args.files, args.turns)
+	if not config_file:
+		parser.error('give a config or --generate DIR')
+	config_file = os.path.abspath(config_file)
+
+	results = [measure(stage, config_file, args.engine, args.jobs) for stage in args.stages]
+	report(results)
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(results, f, indent=1)
@@ -1,53 +1,74 @@
 """Fetches metadata from switchboard files, checks that metadata info is complete, prints
-csv of metadata."""
+csv of metadata.
 
+Only the header of each file is read, up to the "==" line that closes it.  Files
+are parsed on a process pool and the dataframe is built once from all records."""
+
+import argparse
+import multiprocessing
 import os
 import pandas as pd
 import re
 
 
-class Main:
+LABELS = ["FILENAME", "TOPIC#", "DATE", "TRANSCRIBER", "DIFFICULTY", "TOPICALITY", "NATURALNESS", "ECHO_FROM_B",
+          "ECHO_FROM_A", "STATIC_ON_A", "STATIC_ON_B", "BACKGROUND_A", "BACKGROUND_B", "REMARKS"]
 
-    def __init__(self, source):
-        self.d = {}
-        self.df = pd.DataFrame()
-        labels = ["FILENAME", "TOPIC#", "DATE", "TRANSCRIBER", "DIFFICULTY", "TOPICALITY", "NATURALNESS", "ECHO_FROM_B",
-                  "ECHO_FROM_A", "STATIC_ON_A", "STATIC_ON_B", "BACKGROUND_A", "BACKGROUND_B", "REMARKS"]
 
-        for filename in os.listdir(source):
-            with open(os.path.join(source, filename)) as in_file:
-                lines = in_file.readlines()
+def read_header(path):
+    """Lines of the metadata header, from the FILENAME line up to the closing '==' line."""
+    lines = list()
+    with open(path) as in_file:
+        for line in in_file:
+            if lines or line.startswith("FILENAME"):
+                lines.append(line)
+                if line.startswith("=="):
+                    break
+    return lines
 
-                # find start of metadata lines
-                i = 0
-                while i < len(lines) and not lines[i].startswith("FILENAME"):
-                    i += 1
 
-                # store metadata in dictionary
-                while i < len(lines) and not lines[i].startswith("=="):
-                    if len(lines[i].split()) > 1:
-                        key = lines[i].split(':')[0]
-                        for label in labels:  # a fix for odd characters showing up in metadata labels
-                            if label in key:
-                                key = label
-                        value = re.split(r":[\s|\t]*", lines[i])[1][:-1].strip()
-                        if key == "REMARKS":
-                            while i+1 < len(lines) and not lines[i+1].startswith("==") and len(lines[i+1].split()) > 1:
-                                i += 1
-                                value += ' ' + lines[i].strip()
-                        self.d[key] = value
+def read_metadata(path):
+    """Metadata of one transcript file as a dictionary."""
+    d = {}
+    lines = read_header(path)
+    i = 0
+    while i < len(lines) and not lines[i].startswith("=="):
+        if len(lines[i].split()) > 1:
+            key = lines[i].split(':')[0]
+            for label in LABELS:  # a fix for odd characters showing up in metadata labels
+                if label in key:
+                    key = label
+            value = re.split(r":[\s|\t]*", lines[i])[1][:-1].strip()
+            if key == "REMARKS":
+                while i+1 < len(lines) and not lines[i+1].startswith("==") and len(lines[i+1].split()) > 1:
                     i += 1
+                    value += ' ' + lines[i].strip()
+            d[key] = value
+        i += 1
+    return d
+
 
-                # check for missing metadata
-                excluded_labels = list(set(labels).difference(set(self.d.keys())))
+class Main:
+
+    def __init__(self, source, jobs=1):
+        filenames = os.listdir(source)
+        paths = [os.path.join(source, x) for x in filenames]
+        if jobs > 1:
+            chunksize = max(1, len(paths) // (jobs * 4))
+            with multiprocessing.Pool(jobs) as pool:
+                records = pool.map(read_metadata, paths, chunksize=chunksize)
+        else:
+            records = [read_metadata(x) for x in paths]
 
-                if len(excluded_labels) > 0:
-                    print('{} does not include keys: {}'.format(filename, excluded_labels))
+        # check for missing metadata
+        for filename, d in zip(filenames, records):
+            excluded_labels = list(set(LABELS).difference(set(d.keys())))
+            if len(excluded_labels) > 0:
+                print('{} does not include keys: {}'.format(filename, excluded_labels))
 
-                # merge data into dataframe
-                temp = pd.DataFrame.from_records(self.d, index=[(os.path.splitext(filename)[0])])
-                self.df = pd.concat([self.df, temp])
-                self.df.index.rename('FILE', inplace=True)
+        self.d = records[-1] if records else {}
+        self.df = pd.DataFrame(records, index=[os.path.splitext(x)[0] for x in filenames])
+        self.df.index.rename('FILE', inplace=True)
 
     def get_df(self):
         return self.df
@@ -57,3 +78,13 @@ class Main:
 
     def print_csv(self, out_file):
         self.df.to_csv(out_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", help="directory of switchboard transcript files")
+    parser.add_argument("output", help="metadata csv file")
+    parser.add_argument("-j", "--jobs", type=int,
+                        help="number of processes to read the files with (default: all cores)")
+    args = parser.parse_args()
+    Main(args.source, args.jobs or os.cpu_count()).print_csv(args.output)
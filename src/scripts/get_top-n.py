@@ -3,37 +3,118 @@
 """
 Simple class to generate the top N specified number of common words
 given the alignment file.
+
+Only the sentence_dtok column is read, a chunk of rows at a time.  Each chunk
+is counted on a worker process and the partial counts are merged, either
+exactly or, with a capacity, into a bounded Space-Saving summary that keeps
+approximate counts of the most frequent words only.
 """
 
+import argparse
+import heapq
+import multiprocessing
 import sys
-from collections import Counter
-import pandas as pd
+from collections import Counter, deque
+from operator import itemgetter
 
 sys.path.append("..")
-from data import read_tsv
+from data import iter_tsv, parse_lists, STR_LIST
 import pickle
 
 
-class Main:
+COLUMN = "sentence_dtok"
+
+
+def count_chunk(cells):
+    counts = Counter()
+    for sent in parse_lists(cells, STR_LIST):
+        for word in sent:
+            if word != "//" and word != "--":
+                counts[word] += 1
+    return counts
+
+
+class SpaceSaving:
+    """Approximate counts of the most frequent words, holding at most
+    capacity of them (Metwally et al., merged one batch of exact counts at a
+    time).  A word's count is over by at most its error."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = dict()
+        self.errors = dict()
+
+    def update(self, counts):
+        # an unseen word may have been dropped with up to the smallest kept count
+        floor = min(self.counts.values()) if len(self.counts) >= self.capacity else 0
+        for word, n in counts.items():
+            if word in self.counts:
+                self.counts[word] += n
+            else:
+                self.counts[word] = floor + n
+                self.errors[word] = floor
+        if len(self.counts) > self.capacity:
+            self.counts = dict(heapq.nlargest(self.capacity, self.counts.items(), key=itemgetter(1)))
+            self.errors = {word: self.errors[word] for word in self.counts}
 
-    def __init__(self, alignments_file, output_file, top=100):
-        print("Reading alignments", flush=True, end='\n')
-        df = read_tsv(alignments_file)
+    def most_common(self, n):
+        return heapq.nlargest(n, self.counts.items(), key=itemgetter(1))
+
+    def guaranteed(self, n):
+        """Whether the n most common words are surely the true top n: each
+        one's count less its error still beats the next word's count."""
+        top = self.most_common(n + 1)
+        if len(top) <= n:
+            return True
+        return min(count - self.errors[word] for word, count in top[:n]) >= top[n][1]
+
+
+def iter_counts(alignments_file, chunksize, jobs):
+    """Counts of each chunk of sentences, in file order.  At most two chunks
+    per process are in flight."""
+    chunks = (df[COLUMN].tolist() for df in iter_tsv(alignments_file, chunksize, schema={COLUMN: STR_LIST},
+                                                    usecols=[COLUMN]))
+    if jobs <= 1:
+        for cells in chunks:
+            yield count_chunk(cells)
+        return
+
+    with multiprocessing.Pool(jobs) as pool:
+        pending = deque()
+        for cells in chunks:
+            pending.append(pool.apply_async(count_chunk, (cells,)))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+class Main:
 
+    def __init__(self, alignments_file, output_file, top=100, jobs=1, chunksize=10000, capacity=None):
         print("Counting sentences", flush=True, end='\n')
-        sentences = df["sentence_dtok"].tolist()
-        counts = Counter()
-        for sent in sentences:
-            for word in sent:
-                if word != "//" and word != "--":
-                    counts[word] += 1
+        counts = Counter() if capacity is None else SpaceSaving(capacity)
+        for partial in iter_counts(alignments_file, chunksize, jobs):
+            counts.update(partial)
 
+        if capacity is not None and not counts.guaranteed(top):
+            print("Warning: the top {} words are approximate, raise --capacity to be sure of them".format(top))
         results = [x for x, _ in counts.most_common(top)]
-        pickle.dump(set(results), open(out, 'wb'))
+        pickle.dump(set(results), open(output_file, 'wb'))
         print("Complete!")
 
 
 if __name__ == "__main__":
     align = "/mnt//d//projects//swb_errors_surprisal//exp4//data//swbd_cont.tsv"
     out = "top-n.P"
-    Main(align, out)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("alignments", nargs='?', default=align, help="preprocessed alignments file")
+    parser.add_argument("output", nargs='?', default=out, help="pickled set of the top words")
+    parser.add_argument("-n", "--top", type=int, default=100, help="number of words to keep")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of processes to count with")
+    parser.add_argument("--chunksize", type=int, default=10000, help="rows counted per task")
+    parser.add_argument("--capacity", type=int,
+                        help="count approximately, keeping at most this many words in memory "
+                             "(a few times --top)")
+    args = parser.parse_args()
+    Main(args.alignments, args.output, args.top, args.jobs, args.chunksize, args.capacity)
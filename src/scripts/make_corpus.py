@@ -0,0 +1,191 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Generates a synthetic Switchboard-like project for benchmarks.
+
+The raw alignments mix the labels, _a/_b splits, slash units ('//', named
+'None'), partial words ('---'), 'you know', CONT_TREE/CONT_MS style
+differences and 'going to' reductions the real data has, in roughly its
+proportions.  They are run through the preprocessor passes and the tags and
+ngram/gru score files are then sized to the detokenized sentences, so the
+project loads and extracts like the real one.
+
+project_dir/
+	raw_alignments.tsv		input of preprocessor.py
+	config.yaml				config for main.py, with an absolute project_dir
+	data/swbd_cont.tsv		preprocessed alignments
+	data/metadata.csv
+	data/swbd_{ptb,ms}_{tags,ngram_scores,gru_scores}.tsv
+	data/top-n.P
+"""
+
+import argparse
+import os
+import pickle
+import random
+import sys
+from collections import Counter
+from types import SimpleNamespace
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import preprocessor
+
+
+FUNCTION_WORDS = ['i', 'the', 'and', 'uh', 'that', 'it', 'a', 'to', 'of', 'so', 'um', 'well', 'like', 'in', 'is']
+DISFLUENCIES = ['O', 'O', 'O', 'O', 'C', 'E', 'IP', 'BE', 'IE']
+CONTRACTIONS = [('do', "n't"), ('it', "'s"), ('that', "'s"), ('i', "'m"), ('they', "'re")]
+ALIGN_COLS = ['file', 'speaker', 'turn', 'sent_num', 'sentence', 'names', 'disfl',
+			  'ms_sentence', 'ms_names', 'ms_disfl', 'comb_sentence', 'comb_ann']
+MODEL = 'gru'
+
+
+class Utterance:
+	"""Builds the ptb, ms and combined lists of one utterance side by side."""
+
+	def __init__(self, rng, turn):
+		self.rng = rng
+		self.turn = turn
+		self.ptb = list()  # (word, name)
+		self.ms = list()
+		self.comb = list()  # (word, label)
+
+	def name(self, side, split=''):
+		return 'ptb{}_{}{}'.format(self.turn, len(side), split)
+
+	def add(self, label, ptb=None, ms=None, name=None):
+		"""Adds one alignment position; ptb/ms are the words on each side."""
+		if ptb is not None:
+			self.ptb.append((ptb, name or self.name(self.ptb)))
+		if ms is not None:
+			self.ms.append((ms, name or self.name(self.ms)))
+		self.comb.append((ptb if ptb is not None else ms, label))
+
+	def row(self):
+		row = dict()
+		for prefix, side in (('', self.ptb), ('ms_', self.ms)):
+			row[prefix + 'sentence'] = [x[0] for x in side]
+			row[prefix + 'names'] = [x[1] for x in side]
+			row[prefix + 'disfl'] = [self.rng.choice(DISFLUENCIES) for x in side if x[1] != 'None']
+		row['comb_sentence'] = [x[0] for x in self.comb]
+		row['comb_ann'] = [x[1] for x in self.comb]
+		return row
+
+
+def word(rng, vocab):
+	if rng.random() < 0.5:
+		return rng.choice(FUNCTION_WORDS)
+	# zipf-like tail so the top-n words are meaningful
+	return vocab[min(int(rng.paretovariate(1.1)) - 1, len(vocab) - 1)]
+
+
+def utterance(rng, vocab, turn):
+	u = Utterance(rng, turn)
+	for _ in range(rng.randint(1, 16)):
+		r = rng.random()
+		if r < 0.04:
+			u.add('O', '//', '//', name='None')
+		elif r < 0.07:
+			first, second = rng.choice(CONTRACTIONS)
+			u.add('O', first, first, name=u.name(u.ptb, '_a'))
+			u.add('O', second, second, name=u.name(u.ptb, '_b'))
+		elif r < 0.09:
+			u.add('O', 'you', 'you')
+			u.add('O', 'know', 'know')
+		elif r < 0.10:
+			# a partial word is only renamed 'None' when a word follows it
+			u.add('O', '---', '---')
+			w = word(rng, vocab)
+			u.add('O', w, w)
+		elif r < 0.15:
+			u.add('INS', ptb=word(rng, vocab))
+		elif r < 0.20:
+			u.add('DEL', ms=word(rng, vocab))
+		elif r < 0.27:
+			u.add('SUB_TREE', ptb=word(rng, vocab))
+			u.add('SUB_MS', ms=word(rng, vocab))
+		elif r < 0.285:
+			u.add('CONT_MS', ms='gonna')
+			u.add('CONT_TREE', ptb='going')
+			u.add('CONT_TREE', ptb='to')
+		elif r < 0.29:
+			u.add('SUB_MS', ms='going')
+			u.add('SUB_MS', ms='to')
+			u.add('SUB_TREE', ptb='going')
+			u.add('INS', ptb='to')
+		else:
+			w = word(rng, vocab)
+			u.add('O', w, w)
+	return u.row()
+
+
+def raw_alignments(n_files, turns, seed=0):
+	rng = random.Random(seed)
+	vocab = ['w{}'.format(i) for i in range(5000)]
+	rows = list()
+	for f in range(n_files):
+		for turn in range(1, turns + 1):
+			for sent_num in range(rng.randint(1, 3)):
+				row = utterance(rng, vocab, turn)
+				row.update({'file': 'sw{}.trans'.format(2001 + f), 'speaker': 'AB'[turn % 2],
+							'turn': turn, 'sent_num': sent_num})
+				rows.append(row)
+	return pd.DataFrame(rows, columns=ALIGN_COLS)
+
+
+def model_files(df, rng):
+	"""Tags and score files sized to the detokenized sentences, which is what
+	data.verify checks them against (scores have one more, for EOS)."""
+	ix = ['file', 'speaker', 'turn', 'sent_num']
+	files = dict()
+	for dtype, prefix in (('ptb', ''), ('ms', 'ms_')):
+		lengths = df[prefix + 'sentence_dtok'].apply(len)
+		tags = df[ix].copy()
+		tags['tags'] = [['NN'] * n for n in lengths]
+		tags['shapes'] = [[rng.randint(0, 3) for _ in range(n)] for n in lengths]
+		files['swbd_{}_tags.tsv'.format(dtype)] = tags
+		for model in ('ngram', MODEL):
+			scores = df[ix].copy()
+			scores['scores'] = [[rng.uniform(0.001, 1) for _ in range(n + 1)] for n in lengths]
+			files['swbd_{}_{}_scores.tsv'.format(dtype, model)] = scores
+	return files
+
+
+def make_corpus(project_dir, n_files=50, turns=60, seed=0, top=100):
+	"""Writes a synthetic project under project_dir and returns its config path."""
+	data_path = os.path.join(project_dir, 'data')
+	os.makedirs(data_path, exist_ok=True)
+
+	raw = raw_alignments(n_files, turns, seed)
+	raw.to_csv(os.path.join(project_dir, 'raw_alignments.tsv'), sep='\t', index=None)
+
+	args = SimpleNamespace(cont=True, detokenize=True, engine='columnar')
+	align = preprocessor.transform(raw.copy(), args, log=lambda x: None)
+	align.to_csv(os.path.join(data_path, 'swbd_cont.tsv'), sep='\t', index=None)
+
+	files = align['file'].drop_duplicates()
+	pd.DataFrame({'FILE': files.str[:-len('.trans')], 'TRANSCRIBER': ['T{}'.format(i % 9) for i in range(len(files))]}) \
+		.to_csv(os.path.join(data_path, 'metadata.csv'), index=None)
+	for name, df in model_files(align, random.Random(seed + 1)).items():
+		df.to_csv(os.path.join(data_path, name), sep='\t', index=None)
+
+	counts = Counter(w for sent in align['sentence_dtok'] for w in sent if w != '//' and w != '--')
+	pickle.dump(set(x for x, _ in counts.most_common(top)), open(os.path.join(data_path, 'top-n.P'), 'wb'))
+
+	config = os.path.join(project_dir, 'config.yaml')
+	with open(config, 'w') as f:
+		f.write('alignments_file: "swbd_cont.tsv"\n')
+		f.write('project_dir: "{}"\n'.format(os.path.abspath(project_dir)))
+		f.write('nnmodel: "{}"\n'.format(MODEL))
+		f.write('debug: False\n')
+	return config
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("project_dir", help="directory to write the synthetic project to")
+	parser.add_argument("-f", "--files", type=int, default=50, help="number of conversation files")
+	parser.add_argument("-t", "--turns", type=int, default=60, help="turns per file (1-3 utterances each)")
+	parser.add_argument("-s", "--seed", type=int, default=0)
+	args = parser.parse_args()
+	print(make_corpus(args.project_dir, args.files, args.turns, args.seed))
@@ -18,13 +18,25 @@ For other use (language model)
 - Sentences are printed sentence by sentence.
 - Empty sentences are left blank.
 
+The alignments are read once, a chunk of rows at a time, and every output file
+is written from that one read through a large buffer.  With --all the tagger
+and language model files are written together.
+
 """
 
 
 import argparse
 import csv
-from ast import literal_eval
-import pandas as pd
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from data import iter_tsv, parse_lists, STR_LIST
+
+
+LABEL = 'SYM'
+EMPTY = '#'  # placeholder for tagger
+BUFFER_SIZE = 1 << 20
 
 
 def process_token(token):
@@ -43,50 +55,60 @@ def is_empty(sent):
 	return all([is_special(x) for x in sent])
 
 
-def write_file(sentences, output):
-	LABEL = 'SYM'
-	EMPTY = '#'  # placeholder for tagger 
-	
-	sentences = [literal_eval(x) for x in sentences]
-	writer = csv.writer(open(output, 'w'), delimiter='\t', lineterminator="\n")
-	
-	for sent in sentences:
-		if is_empty(sent):
-			sent = EMPTY
-		else:
-			# special char removal needed for lm which uses tokenized sentence!
-			sent = [x for x in sent if not is_special(x)]
-			sent = [process_token(x) for x in sent]
-	
-		if args.tagging:
-			for token in sent:
-				writer.writerow([token, LABEL])
-			writer.writerow("")
-		else:
-			if sent == EMPTY:
-				writer.writerow("")
-			else:
-				result = [' '.join(sent)]
-				writer.writerow(result)
-		
+def format_sentence(sent, tagging):
+	"""Rows of one sentence in the tagger or language model format."""
+	if is_empty(sent):
+		sent = EMPTY
+	else:
+		# special char removal needed for lm which uses tokenized sentence!
+		sent = [process_token(x) for x in sent if not is_special(x)]
+
+	if tagging:
+		return [[token, LABEL] for token in sent] + [[]]
+	if sent == EMPTY:
+		return [[]]
+	return [[' '.join(sent)]]
+
+
+class Exporter:
+	"""One output file, written a chunk of sentences at a time."""
+
+	def __init__(self, output, tagging):
+		self.tagging = tagging
+		self.file = open(output, 'w', buffering=BUFFER_SIZE)
+		self.writer = csv.writer(self.file, delimiter='\t', lineterminator="\n")
+
+	def write(self, sentences):
+		rows = list()
+		for sent in sentences:
+			rows.extend(format_sentence(sent, self.tagging))
+		self.writer.writerows(rows)
+
+	def close(self):
+		self.file.close()
+
+
+def get_exporters(outdir, formats):
+	"""(column, Exporter) of the ptb and ms files of each format, tagging or not."""
+	exporters = list()
+	for tagging in formats:
+		label = '' if tagging else '_dtok'
+		for dtype, col in (('ptb', 'sentence'), ('ms', 'ms_sentence')):
+			output = outdir + "swbd_" + dtype + "_sents" + label + ".txt"
+			exporters.append((col + label, Exporter(output, tagging)))
+	return exporters
+
 
 def main(args):
-	df = pd.read_csv(args.file, delimiter='\t')
-	
-	label = ''
-	ptb_sent = 'sentence'
-	ms_sent = 'ms_sentence'
-	
-	if not args.tagging:
-		label += '_dtok'
-		ptb_sent += label
-		ms_sent += label
-		
-	ptb_out = args.outdir + "swbd_ptb_sents" + label + ".txt"
-	write_file(df[ptb_sent].tolist(), ptb_out)
-	
-	ms_out = args.outdir + "swbd_ms_sents" + label + ".txt"
-	write_file(df[ms_sent].tolist(), ms_out)
+	formats = [True, False] if args.all else [args.tagging]
+	exporters = get_exporters(args.outdir, formats)
+	cols = [col for col, _ in exporters]
+
+	for df in iter_tsv(args.file, args.chunksize, schema={col: STR_LIST for col in cols}, usecols=cols):
+		for col, exporter in exporters:
+			exporter.write(parse_lists(df[col].tolist(), STR_LIST))
+	for _, exporter in exporters:
+		exporter.close()
 
 
 if __name__=="__main__":
@@ -95,5 +117,9 @@ if __name__=="__main__":
 	parser.add_argument("outdir", help="Output file directory")
 	parser.add_argument("--tagging", "-t", action="store_true",
 						help="Output word by word with tag for tagger decoding.")
+	parser.add_argument("--all", "-a", action="store_true",
+						help="Output the tagger and language model files in one read.")
+	parser.add_argument("--chunksize", type=int, default=10000,
+						help="Rows read at a time.")
 	args = parser.parse_args()
 	main(args)
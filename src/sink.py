@@ -0,0 +1,344 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Buffered writers for the extracted error sequences.
+
+Error sequences are added one at a time as the engines find them.  They are
+kept in a batch until batch_size of them are buffered, then the surprisal
+differences of the batch are set at once and every writer gets the batch.
+Only one batch is ever held in memory.  If the run fails the writers are
+aborted instead, removing their partial outputs so none is left looking
+finished.
+
+Parquet output needs pyarrow, which is optional.  The SQLite output is an
+indexed store of the same rows for queries, see errstore.py.
+
+A writer opened with a previous output can copy the rows of a conversation
+from it (copy), so only the conversations that changed since are extracted
+again.  The previous output is removed when the writer closes, and put
+back in place of the partial output if the writer is aborted.
+"""
+
+
+import csv
+import os
+import sqlite3
+import profiler
+import surprisal
+from errinfo import ErrSeq
+
+try:
+	import pyarrow as pa
+	import pyarrow.parquet as pq
+except ImportError:
+	pa = None
+
+
+BATCH_SIZE = 10000
+
+
+class ResultSink:
+
+	def __init__(self, writers, batch_size=BATCH_SIZE):
+		self.writers = writers
+		self.batch_size = batch_size
+		self.batch = list()
+		self.count = 0
+
+	def add(self, item):
+		self.batch.append(item)
+		self.count += 1
+		if len(self.batch) >= self.batch_size:
+			self.flush()
+
+	def copy(self, file_num):
+		"""Copies the sequences of conversation file_num from the previous output."""
+		self.flush()
+		with profiler.stage('copy'):
+			n = [writer.copy(file_num) for writer in self.writers][0]
+			profiler.count('errors', n)
+		self.count += n
+
+	def flush(self):
+		if not self.batch:
+			return
+		with profiler.stage('surprisal'):
+			surprisal.set_sup_diffs(self.batch)
+		with profiler.stage('write'):
+			profiler.count('errors', len(self.batch))
+			for writer in self.writers:
+				writer.write(self.batch)
+		self.batch = list()
+
+	def close(self):
+		self.flush()
+		for writer in self.writers:
+			writer.close()
+
+	def abort(self):
+		"""Drops the buffered batch and removes every writer's partial output."""
+		self.batch = list()
+		for writer in self.writers:
+			writer.abort()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, *exc):
+		if exc_type is None:
+			self.close()
+		else:
+			self.abort()
+
+
+def restore(path, previous=None):
+	"""Replaces a partial output with the previous one, or removes it if none."""
+	if previous:
+		os.replace(previous, path)
+	elif os.path.exists(path):
+		os.remove(path)
+
+
+def file_num(index):
+	"""Conversation number of an output index, e.g. '4103' of '4103_12_0'."""
+	return index.split('_', 1)[0]
+
+
+class PreviousOutput:
+	"""Rows of a previous output, handed out a conversation at a time.
+
+	runs yields (file_num, position, rows) for each run of rows of the same
+	conversation, in file order.  Conversations are asked for in the order
+	they were written, so the output is read once, forward and only as far
+	as needed.  Runs passed over on the way, e.g. of conversations that
+	changed, are remembered by position only and read again with read if
+	they are asked for after all."""
+
+	def __init__(self, runs, read):
+		self.runs = runs
+		self.read = read
+		self.next = next(runs, None)
+		self.skipped = dict()
+
+	def take(self, file_num):
+		"""Runs of rows of conversation file_num, in order."""
+		if file_num in self.skipped:
+			return [self.read(x) for x in self.skipped.pop(file_num)]
+		while self.next is not None and self.next[0] != file_num:
+			self.skipped.setdefault(self.next[0], list()).append(self.next[1])
+			self.next = next(self.runs, None)
+		rows = list()
+		while self.next is not None and self.next[0] == file_num:
+			rows.append(self.next[2])
+			self.next = next(self.runs, None)
+		return rows
+
+	def close(self):
+		self.next = None
+		self.runs.close()
+
+
+def tsv_runs(path):
+	"""Runs of a tsv output as lines of bytes, positioned by byte range.  Each
+	row is one line, no value holds a newline."""
+	with open(path, 'rb') as f:
+		start = pos = len(f.readline())
+		key, lines = None, list()
+		for line in f:
+			row_file = file_num(line.split(b'\t', 1)[0].decode('utf-8'))
+			if row_file != key and lines:
+				yield key, (start, pos), lines
+				start, lines = pos, list()
+			key = row_file
+			lines.append(line)
+			pos += len(line)
+		if lines:
+			yield key, (start, pos), lines
+
+
+def read_tsv_run(path, position):
+	start, end = position
+	with open(path, 'rb') as f:
+		f.seek(start)
+		return f.read(end - start).splitlines(keepends=True)
+
+
+class TsvWriter:
+
+	def __init__(self, path, models=(), previous=None):
+		self.previous = previous
+		if previous:
+			self.old = PreviousOutput(tsv_runs(previous), lambda x: read_tsv_run(previous, x))
+		self.path = path
+		self.file = open(path, 'w', newline='')
+		self.writer = csv.writer(self.file, delimiter='\t')
+		self.writer.writerow(ErrSeq(models).get_row_header())
+
+	def write(self, batch):
+		self.writer.writerows(item.get_row() for item in batch)
+
+	def copy(self, file_num):
+		lines = [line for run in self.old.take(file_num) for line in run]
+		# the lines are already written as csv, they go straight to the file
+		self.file.flush()
+		self.file.buffer.write(b''.join(lines))
+		return len(lines)
+
+	def close(self):
+		self.file.close()
+		if self.previous:
+			self.old.close()
+			os.remove(self.previous)
+
+	def abort(self):
+		self.file.close()
+		if self.previous:
+			self.old.close()
+		restore(self.path, self.previous)
+
+
+def arrow_type(col):
+	"""Arrow type of an output column, from its name."""
+	name = col[3:] if col.startswith('ms_') else col
+	if name == 'del_edge' or name.startswith('disf_'):
+		return pa.bool_()
+	if name.endswith('_scores'):
+		return pa.list_(pa.float64())
+	if name.endswith('_sup'):
+		return pa.float64()
+	if name in ('types', 'tokens', 'shapes', 'disf'):
+		return pa.list_(pa.string())
+	return pa.string()
+
+
+def parquet_runs(path):
+	"""Runs of a parquet output as tables, positioned by row group and rows.
+	One row group, about a batch, is read at a time."""
+	parquet = pq.ParquetFile(path)
+	for group in range(parquet.num_row_groups):
+		table = parquet.read_row_group(group)
+		keys = [file_num(x) for x in table.column('index').to_pylist()]
+		start = 0
+		for i in range(1, len(keys) + 1):
+			if i == len(keys) or keys[i] != keys[start]:
+				yield keys[start], (group, start, i), table.slice(start, i - start)
+				start = i
+
+
+def read_parquet_run(path, position):
+	group, start, stop = position
+	return pq.ParquetFile(path).read_row_group(group).slice(start, stop - start)
+
+
+class ParquetWriter:
+
+	def __init__(self, path, models=(), previous=None):
+		if pa is None:
+			raise ImportError('pyarrow is required for parquet output')
+		self.header = ErrSeq(models).get_row_header()
+		self.schema = pa.schema([(col, arrow_type(col)) for col in self.header])
+		self.previous = previous
+		if previous:
+			self.old = PreviousOutput(parquet_runs(previous), lambda x: read_parquet_run(previous, x))
+		self.path = path
+		self.writer = pq.ParquetWriter(path, self.schema)
+
+	def write(self, batch):
+		columns = [list() for _ in self.header]
+		for item in batch:
+			for values, value in zip(columns, item.get_row()):
+				values.append(value)
+		arrays = list()
+		for values, field in zip(columns, self.schema):
+			if field.type == pa.string():
+				# top_n is False when the sequence has no top word
+				values = [None if x is None or x is False else str(x) for x in values]
+			arrays.append(pa.array(values, type=field.type))
+		self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+	def copy(self, file_num):
+		runs = self.old.take(file_num)
+		for run in runs:
+			self.writer.write_table(run)
+		return sum(x.num_rows for x in runs)
+
+	def close(self):
+		self.writer.close()
+		if self.previous:
+			self.old.close()
+			os.remove(self.previous)
+
+	def abort(self):
+		self.writer.close()
+		if self.previous:
+			self.old.close()
+		restore(self.path, self.previous)
+
+
+# columns of the sqlite store with a secondary index
+INDEXED = ('index', 'transcriber', 'error_type', 'del_edge', 'top_n', 'ms_top_n')
+
+
+def sqlite_type(col):
+	"""SQLite type of an output column, from its name."""
+	name = col[3:] if col.startswith('ms_') else col
+	if name == 'del_edge' or name.startswith('disf_'):
+		return 'INTEGER'
+	if name.endswith('_sup'):
+		return 'REAL'
+	return 'TEXT'
+
+
+class SqliteWriter:
+	"""Writes the rows to an 'errors' table, in order under 'seq'.  The
+	indexes are built on close, after every row is in."""
+
+	def __init__(self, path, models=(), previous=None):
+		if os.path.exists(path):
+			os.remove(path)
+		self.header = ErrSeq(models).get_row_header()
+		self.types = [sqlite_type(col) for col in self.header]
+		self.path = path
+		self.conn = sqlite3.connect(path)
+		self.conn.execute('CREATE TABLE errors (seq INTEGER PRIMARY KEY, {})'.format(
+			', '.join('"{}" {}'.format(col, t) for col, t in zip(self.header, self.types))))
+		cols = ', '.join('"{}"'.format(col) for col in self.header)
+		self.insert = 'INSERT INTO errors ({}) VALUES ({})'.format(cols, ', '.join('?' * len(self.header)))
+		self.previous = previous
+		if previous:
+			self.conn.execute('ATTACH DATABASE ? AS prev', (previous,))
+			# a conversation is a range of the index, see errstore.ErrorStore.where
+			self.copy_rows = 'INSERT INTO errors ({0}) SELECT {0} FROM prev.errors ' \
+							 'WHERE "index" >= ? AND "index" < ? ORDER BY seq'.format(cols)
+
+	def convert(self, row):
+		values = list()
+		for value, t in zip(row, self.types):
+			if t == 'INTEGER':
+				value = int(value)
+			elif t == 'TEXT':
+				# top_n is False when the sequence has no top word
+				value = None if value is None or value is False else str(value)
+			values.append(value)
+		return values
+
+	def write(self, batch):
+		self.conn.executemany(self.insert, (self.convert(item.get_row()) for item in batch))
+
+	def copy(self, file_num):
+		return self.conn.execute(self.copy_rows, (file_num + '_', file_num + chr(ord('_') + 1))).rowcount
+
+	def close(self):
+		for col in INDEXED:
+			self.conn.execute('CREATE INDEX "errors_{0}" ON errors ("{0}")'.format(col))
+		self.conn.commit()
+		if self.previous:
+			self.conn.execute('DETACH DATABASE prev')
+		self.conn.close()
+		if self.previous:
+			os.remove(self.previous)
+
+	def abort(self):
+		self.conn.rollback()
+		self.conn.close()
+		restore(self.path, self.previous)
@@ -0,0 +1,127 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Memory-mapped columnar store for the merged alignment corpus.
+
+The store is a directory of .npy files.  Scalar columns are saved as one
+array each, list-valued columns as a flat value buffer plus an offsets array
+(see columnar.Ragged).  Strings are saved as fixed width unicode arrays so
+every file can be memory-mapped without unpickling anything.  List columns
+of strings are interned: their values are saved as small integer codes plus
+a vocab file of the distinct strings (see vocab.py).
+"""
+
+
+import json
+import os
+import numpy as np
+import pandas as pd
+from columnar import Ragged
+from vocab import Vocab
+
+
+META_FILE = 'meta.json'
+INDEX_FILE = 'index.npy'
+
+
+def _as_array(values):
+	arr = np.asarray(values)
+	if arr.dtype == object:
+		arr = arr.astype(str)
+	return arr
+
+
+def _is_list_column(series):
+	first = series.dropna()
+	return len(first) > 0 and isinstance(first.iloc[0], list)
+
+
+def write_store(df, path):
+	"""Writes the dataframe to path as a columnar store."""
+	os.makedirs(path, exist_ok=True)
+	columns = dict()
+	for col in df.columns:
+		if _is_list_column(df[col]):
+			ragged = Ragged.from_lists(df[col].tolist())
+			if ragged.values.dtype.kind in 'OU':
+				ragged = ragged.encode()
+				np.save(os.path.join(path, col + '.vocab.npy'), ragged.vocab.strings)
+				columns[col] = 'coded'
+			else:
+				columns[col] = 'list'
+			np.save(os.path.join(path, col + '.values.npy'), _as_array(ragged.values))
+			np.save(os.path.join(path, col + '.offsets.npy'), ragged.offsets)
+		else:
+			np.save(os.path.join(path, col + '.npy'), _as_array(df[col].to_numpy()))
+			columns[col] = 'scalar'
+	np.save(os.path.join(path, INDEX_FILE), _as_array(df.index.to_numpy()))
+
+	meta = {'rows': len(df), 'index_name': df.index.name, 'columns': list(df.columns), 'kinds': columns}
+	with open(os.path.join(path, META_FILE), 'w') as f:
+		json.dump(meta, f, indent=1)
+
+
+def open_store(path):
+	"""Memory-maps the store at path and returns it as a Corpus."""
+	with open(os.path.join(path, META_FILE), 'r') as f:
+		meta = json.load(f)
+
+	columns = dict()
+	for col in meta['columns']:
+		if meta['kinds'][col] in ('list', 'coded'):
+			values = np.load(os.path.join(path, col + '.values.npy'), mmap_mode='r')
+			offsets = np.load(os.path.join(path, col + '.offsets.npy'), mmap_mode='r')
+			vocab = None
+			if meta['kinds'][col] == 'coded':
+				vocab = Vocab(np.load(os.path.join(path, col + '.vocab.npy')))
+			columns[col] = Ragged(values, offsets, vocab)
+		else:
+			columns[col] = np.load(os.path.join(path, col + '.npy'), mmap_mode='r')
+	index = np.load(os.path.join(path, INDEX_FILE), mmap_mode='r')
+	return Corpus(index, columns, meta['columns'], meta['index_name'])
+
+
+def exists(path):
+	return os.path.exists(os.path.join(path, META_FILE))
+
+
+class Corpus:
+	"""Column access to a stored corpus.  List-valued columns are Ragged."""
+
+	def __init__(self, index, columns, order, index_name='index'):
+		self.index = index
+		self.columns = order
+		self.index_name = index_name
+		self._columns = columns
+
+	def __len__(self):
+		return len(self.index)
+
+	def __getitem__(self, col):
+		return self._columns[col]
+
+	def __contains__(self, col):
+		return col in self._columns
+
+	def take(self, rows):
+		"""A new in-memory Corpus holding only the given row positions."""
+		columns = {k: v.take(rows) if isinstance(v, Ragged) else v[rows] for k, v in self._columns.items()}
+		return Corpus(self.index[rows], columns, self.columns, self.index_name)
+
+	def to_frame(self):
+		"""Materializes the corpus as a dataframe of Python lists."""
+		data = dict()
+		for col in self.columns:
+			v = self._columns[col]
+			data[col] = v.to_lists() if isinstance(v, Ragged) else v.tolist()
+		df = pd.DataFrame(data, columns=self.columns, index=self.index.tolist())
+		df.index.name = self.index_name
+		return df
+
+
+def group_rows(values):
+	"""Row positions of each distinct value, in order of first appearance."""
+	values = np.asarray(values)
+	_, first, inverse, counts = np.unique(values, return_index=True, return_inverse=True, return_counts=True)
+	rows = np.split(np.argsort(inverse, kind='stable'), np.cumsum(counts)[:-1])
+	return [rows[i] for i in np.argsort(first)]
@@ -0,0 +1,67 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Batched surprisal statistics over every error sequence.
+
+The score lists of all Trans objects are gathered into one ragged array of
+log2 scores, one span per Trans and score stream.  Span statistics are then
+segmented reductions over that array, so the PTB-MS differences of the whole
+corpus come out of a handful of array operations.
+"""
+
+
+import itertools
+import math
+import numpy as np
+import columnar
+
+
+class ScoreSpans:
+	"""log2 scores of many spans stored as a Ragged array."""
+
+	def __init__(self, spans):
+		lengths = np.fromiter((len(x) for x in spans), dtype=np.int64, count=len(spans))
+		offsets = np.zeros(len(spans) + 1, dtype=np.int64)
+		np.cumsum(lengths, out=offsets[1:])
+		values = np.fromiter(map(math.log2, itertools.chain.from_iterable(spans)),
+							 dtype=np.float64, count=int(offsets[-1]))
+		self.log2 = columnar.Ragged(values, offsets)
+
+	def lengths(self):
+		return self.log2.lengths()
+
+	def sum(self):
+		"""Sum of each span, added left to right like the builtin sum."""
+		lengths = self.lengths()
+		starts = self.log2.offsets[:-1]
+		totals = np.zeros(len(lengths))
+		for k in range(int(lengths.max()) if len(lengths) else 0):
+			rows = lengths > k
+			totals[rows] += self.log2.values[starts[rows] + k]
+		return totals
+
+	def mean(self):
+		with np.errstate(divide='ignore', invalid='ignore'):
+			return self.sum() / self.lengths()
+
+
+def set_sup_diffs(results):
+	"""Sets the surprisal differences of every Trans in results at once.  Gives
+	the same values as calling Trans._get_surprisal_value on each of them."""
+	if not results:
+		return
+	trans = [x.ptb for x in results] + [x.ms for x in results]
+	streams = len(trans[0].get_scores())
+	spans = ScoreSpans([scores for t in trans for scores in t.get_scores()])
+	means = spans.mean().reshape(len(trans), streams)
+	lengths = spans.lengths().reshape(len(trans), streams)[:, 0]
+
+	# ptb is compared against ms and ms against ptb
+	n = len(results)
+	other = np.concatenate([np.arange(n, 2 * n), np.arange(n)])
+	need = lengths > 1
+	if (lengths[other[need]] == 0).any():
+		raise ZeroDivisionError('division by zero')
+	diffs = means[need] - means[other[need]]
+	for i, sups in zip(np.flatnonzero(need).tolist(), diffs.tolist()):
+		trans[i].set_sups(sups)
@@ -43,6 +43,43 @@ def read_metadata(metadata_file):
 	return result
 
 
+def get_col(datatype, dtype):
+	if dtype == 'ptb':
+		data = 'ptb'
+	else:
+		data = 'ms'
+	d = {
+		('ptb', 'token'): 'sentence_dtok',
+		('ms', 'token'): 'ms_sentence_dtok',
+		('ptb', 'name'): 'names',
+		('ms', 'name'): 'ms_names',
+		('ptb', 'shape'): 'shapes',
+		('ms', 'shape'): 'ms_shapes',
+		('ptb', 'score'): 'scores-ngram',
+		('ms', 'score'): 'ms_scores-ngram',
+		('ptb', 'nn_score'): 'scores-gru',
+		('ms', 'nn_score'): 'ms_scores-gru',
+		('ptb', 'disf'): 'disfl',
+		('ms', 'disf'): 'ms_disfl'
+	}
+	return d[(data, datatype)]
+
+
+def get_models(config):
+	"""nnmodel names one model or a list of them, the first is the main nn model."""
+	models = config['nnmodel']
+	if isinstance(models, str):
+		return [models]
+	return list(models)
+
+
+def get_score_cols(dtype, models=()):
+	"""Score columns of ngram, the main nn model, then each extra nn model."""
+	prefix = '' if dtype == 'ptb' else 'ms_'
+	cols = [get_col('score', dtype), get_col('nn_score', dtype)]
+	return cols + [prefix + 'scores-' + model for model in models]
+
+
 def is_special_char(token):
 	return token == '//' or token.startswith('--')
 
@@ -65,20 +102,42 @@ def get_sup_diff(l1, l2):
 	return t1/len(l1) - t2/len(l2)
 
 
+def get_sup_diffs(l1, l2):
+	"""get_sup_diff of several score streams, walking the tokens once.
+	l1 and l2 hold one score list per stream."""
+	return [t1 / len(l1[0]) - t2 / len(l2[0]) for t1, t2 in zip(_sum_log2(l1), _sum_log2(l2))]
+
+
+def _sum_log2(streams):
+	totals = [0] * len(streams)
+	for scores in zip(*streams):
+		totals = [t + math.log2(x) for t, x in zip(totals, scores)]
+	return totals
+
+
+# label sets, built once; see vocab.py for their lookup tables over label codes
+MS_LABELS = frozenset({'DEL', 'SUB_MS', 'CONT_MS'})
+PTB_LABELS = frozenset({'INS', 'SUB_TREE', 'CONT_TREE'})
+ERR_LABELS = frozenset({'INS', 'DEL', 'SUB_TREE', 'SUB_MS'})
+NON_ERROR = frozenset({'O', 'CONT'})
+ON_PTB = PTB_LABELS | NON_ERROR
+ON_MS = MS_LABELS | NON_ERROR
+
+
 def ms_labels():
-	return {'DEL', 'SUB_MS', 'CONT_MS'}
+	return MS_LABELS
 
 
 def ptb_labels():
-	return {'INS', 'SUB_TREE', 'CONT_TREE'}
+	return PTB_LABELS
 
 
 def err_labels():
-	return {'INS', 'DEL', 'SUB_TREE', 'SUB_MS'}
+	return ERR_LABELS
 
 
 def non_error():
-	return {'O', 'CONT'}
+	return NON_ERROR
 
 
 def get_norm_label():
@@ -86,8 +145,8 @@ def get_norm_label():
 
 
 def is_ptb(label):
-	return label in ptb_labels() or label in non_error()
+	return label in ON_PTB
 
 
 def is_ms(label):
-	return label in ms_labels() or label in non_error()
\ No newline at end of file
+	return label in ON_MS
\ No newline at end of file
@@ -0,0 +1,74 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Interned vocabularies for the string columns of the corpus.
+
+A string column is stored as small integer codes into a Vocab of its
+distinct values (see columnar.Ragged.encode), so every token, name and
+disfluency tag is held once.  Checks on the strings become lookups of the
+codes in a table computed once over the vocabulary, e.g. LABELS.table(...)
+for the alignment labels.
+
+Tables have one entry past the vocabulary that is always False, so code -1
+(a missing value) can be looked up too.
+"""
+
+
+import numpy as np
+import util
+
+
+MISSING = -1
+
+
+class Vocab:
+
+	def __init__(self, strings):
+		self.strings = np.asarray(strings, dtype=str)
+		self._codes = None
+
+	@property
+	def codes(self):
+		if self._codes is None:
+			self._codes = {s: i for i, s in enumerate(self.strings.tolist())}
+		return self._codes
+
+	def __len__(self):
+		return len(self.strings)
+
+	@staticmethod
+	def code_dtype(size):
+		return np.uint8 if size <= 1 << 8 else np.uint16 if size <= 1 << 16 else np.int32
+
+	@classmethod
+	def build(cls, values):
+		"""The vocabulary of an array of strings and the codes of its values."""
+		strings, codes = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+		return cls(strings), codes.astype(cls.code_dtype(len(strings)))
+
+	def encode(self, values):
+		"""Codes of strings in this vocabulary, MISSING for unknown ones."""
+		return np.fromiter((self.codes.get(x, MISSING) for x in np.asarray(values).tolist()), dtype=np.int64,
+						   count=len(values))
+
+	def decode(self, codes, fill=''):
+		codes = np.asarray(codes)
+		if not len(self.strings):
+			return np.full(len(codes), fill)
+		return np.where(codes == MISSING, fill, self.strings[codes])
+
+	def table(self, member):
+		"""Boolean lookup table over the codes, from a set of strings or a predicate."""
+		test = member if callable(member) else member.__contains__
+		return np.array([test(x) for x in self.strings.tolist()] + [False], dtype=bool)
+
+	def recode(self, other):
+		"""Table mapping the codes of this vocabulary to those of other."""
+		return np.append(other.encode(self.strings), MISSING)
+
+
+# the alignment labels, coded in a fixed order
+LABELS = Vocab(sorted(util.ptb_labels() | util.ms_labels() | util.non_error()))
+ON_PTB = LABELS.table(util.is_ptb)
+ON_MS = LABELS.table(util.is_ms)
+IS_ERR = LABELS.table(util.err_labels())
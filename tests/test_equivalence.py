@@ -0,0 +1,108 @@
+#! /usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+End to end checks that the engines, job counts and incremental builds of
+preprocessor.py and main.py all write byte-identical output, on a small
+synthetic project (see scripts/make_corpus.py).
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import pytest
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.append(os.path.join(SRC, 'scripts'))
+from make_corpus import make_corpus
+
+
+def run(script, *args, cwd=None):
+	subprocess.run([sys.executable, os.path.join(SRC, script)] + list(args), cwd=cwd, check=True,
+				   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def read(path):
+	with open(path, 'rb') as f:
+		return f.read()
+
+
+def edit_conversation(path, conv, old, new):
+	"""Replaces old by new in the rows of one conversation of a tsv file."""
+	with open(path, newline='') as f:
+		lines = f.readlines()
+	edited = [x.replace(old, new) if x.startswith(conv + '\t') else x for x in lines]
+	assert edited != lines
+	with open(path, 'w', newline='') as f:
+		f.writelines(edited)
+
+
+@pytest.fixture
+def project(tmp_path):
+	config = make_corpus(str(tmp_path), n_files=8, turns=20)
+	return tmp_path, config
+
+
+def extract(project_dir, config, *args):
+	"""Output of a main.py run on the project."""
+	run('main.py', config, *args, cwd=str(project_dir))
+	return read(os.path.join(str(project_dir), 'swbd_errors.tsv'))
+
+
+def test_preprocessor_engines(project):
+	project_dir, _ = project
+	raw = str(project_dir / 'raw_alignments.tsv')
+	outputs = list()
+	for engine in ['columnar', 'fused', 'loop']:
+		output = str(project_dir / (engine + '.tsv'))
+		run('preprocessor.py', raw, output, '-c', '-d', '-e', engine)
+		outputs.append(read(output))
+	assert outputs[0] == outputs[1] == outputs[2]
+
+
+def test_preprocessor_jobs(project):
+	project_dir, _ = project
+	raw = str(project_dir / 'raw_alignments.tsv')
+	outputs = list()
+	run('preprocessor.py', raw, str(project_dir / 'whole.tsv'), '-c', '-d')
+	outputs.append(read(str(project_dir / 'whole.tsv')))
+	for jobs in ['1', '3']:
+		output = str(project_dir / ('stream-' + jobs + '.tsv'))
+		run('preprocessor.py', raw, output, '-c', '-d', '-s', '--chunksize', '50', '-j', jobs)
+		outputs.append(read(output))
+	assert outputs[0] == outputs[1] == outputs[2]
+
+
+def test_preprocessor_incremental(project):
+	project_dir, _ = project
+	raw = str(project_dir / 'raw_alignments.tsv')
+	inc, full = str(project_dir / 'inc.tsv'), str(project_dir / 'full.tsv')
+	run('preprocessor.py', raw, inc, '-c', '-d', '-i')
+	edit_conversation(raw, 'sw2003.trans', "'the'", "'a'")
+	run('preprocessor.py', raw, inc, '-c', '-d', '-i')
+	run('preprocessor.py', raw, full, '-c', '-d')
+	assert read(inc) == read(full)
+
+
+def test_main_engines_and_jobs(project):
+	project_dir, config = project
+	outputs = list()
+	for engine in ['loop', 'columnar']:
+		engine_config = str(project_dir / (engine + '.yaml'))
+		with open(config) as f, open(engine_config, 'w') as out:
+			out.write(f.read() + 'engine: "{}"\n'.format(engine))
+		for jobs in ['1', '3']:
+			outputs.append(extract(project_dir, engine_config, '-j', jobs))
+	assert len(outputs[0].splitlines()) > 1
+	assert all(x == outputs[0] for x in outputs)
+
+
+def test_main_incremental(project):
+	project_dir, config = project
+	extract(project_dir, config, '-i')
+	edit_conversation(str(project_dir / 'data' / 'swbd_ptb_ngram_scores.tsv'), 'sw2003.trans', '0.', '0.5')
+	edit_conversation(str(project_dir / 'data' / 'swbd_ms_tags.tsv'), 'sw2005.trans', "'NN'", "'VB'")
+	incremental = extract(project_dir, config, '-i')
+
+	shutil.rmtree(str(project_dir / 'cache'))
+	assert incremental == extract(project_dir, config)